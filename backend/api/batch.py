@@ -0,0 +1,80 @@
+from typing import AsyncIterator, List, Optional
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from api.chat import sse_event
+from rag.batch import batch_answer
+from rag.metrics import trace_request
+from schemas.DocQA_types import DocConfig, InvokeResponse
+from extension import get_current_doc_config
+from config import batch_qa_max_questions, batch_qa_concurrency
+
+
+router = APIRouter()
+
+
+class BatchQARequest(BaseModel):
+    questions: List[str]
+    # 为True时以SSE逐个返回结果，否则全部完成后一起返回
+    stream: bool = False
+    # 同时进行的LLM调用数，不超过batch_qa_concurrency
+    concurrency: Optional[int] = None
+
+
+@router.post("/qa/batch")
+async def batch_qa(request: BatchQARequest, doc_config: DocConfig = Depends(get_current_doc_config)):
+    """对当前文档（或选中的多个文档）批量提问，不影响对话记录"""
+
+    result = InvokeResponse(
+        source=batch_qa.__name__,
+        state=True,
+        message="批量问答完成！"
+    )
+
+    if doc_config.llm_model is None or doc_config.embedding_model is None:
+        result.state = False
+        result.message = "请先配置模型和embedding model!"
+        return vars(result)
+    if doc_config.vector_store is None and doc_config.corpus_documents is None:
+        result.state = False
+        result.message = "请先上传文件并构建向量库！"
+        return vars(result)
+    if not request.questions or len(request.questions) > batch_qa_max_questions:
+        result.state = False
+        result.message = f"问题数应在1到{batch_qa_max_questions}之间！"
+        return vars(result)
+
+    concurrency = max(1, min(request.concurrency or batch_qa_concurrency, batch_qa_concurrency))
+
+    if request.stream:
+        async def event_stream() -> AsyncIterator[str]:
+            # 事件依次为每个问题的result，最后是done，出错时为error
+            with trace_request("batch_qa"):
+                try:
+                    failed = 0
+                    async for answer in batch_answer(doc_config, request.questions, concurrency):
+                        failed += "error" in answer
+                        yield sse_event("result", answer)
+                    yield sse_event("done", {"count": len(request.questions), "failed": failed})
+                except Exception as e:
+                    yield sse_event("error", {"message": f"{batch_qa.__name__}: 批量问答失败！\n{e}"})
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    try:
+        with trace_request("batch_qa"):
+            answers = [answer async for answer in batch_answer(doc_config, request.questions, concurrency)]
+    except Exception as e:
+        result.state = False
+        result.message = f"批量问答失败！\n{e}"
+        return vars(result)
+
+    answers.sort(key=lambda answer: answer["index"])
+    failed = sum("error" in answer for answer in answers)
+    if failed:
+        result.message = f"批量问答完成，{failed}个问题失败！"
+    result.addition_args = {"results": answers}
+
+    return vars(result)
@@ -1,10 +1,17 @@
-from fastapi import APIRouter
+import json
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from langchain_core.messages import AIMessageChunk
 
 from rag.models import build_rag_graph
-from rag.qa import qa_answer
-from schemas.DocQA_types import InvokeResponse
-from extension import current_doc_config
+from rag.qa import qa_answer, lookup_cached_answer, remember_answer, build_graph_input, save_turn
+from rag.answer_cache import answer_cache
+from rag.metrics import trace_request
+from schemas.DocQA_types import DocConfig, InvokeResponse
+from extension import get_current_doc_config
 
 router = APIRouter()
 
@@ -12,31 +19,117 @@ class ChatRequest(BaseModel):
     question: str
 
 
-@router.post("/chat")
-async def chat(request: ChatRequest):
+async def ensure_graph(doc_config: DocConfig):
     result = InvokeResponse(
-        source=chat.__name__,
+        source=ensure_graph.__name__,
         state=True
     )
 
-    if current_doc_config.graph is None:
-        build_rag_graph_result = build_rag_graph(current_doc_config)
+    if doc_config.graph is None:
+        build_rag_graph_result = await build_rag_graph(doc_config)
         if build_rag_graph_result.state:
-            current_doc_config.graph = build_rag_graph_result.addition_args
+            doc_config.graph = build_rag_graph_result.addition_args
         else:
             result.state = False
             result.message = build_rag_graph_result.source+": "+build_rag_graph_result.message
+
+    return result
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat")
+async def chat(request: ChatRequest, doc_config: DocConfig = Depends(get_current_doc_config)):
+    result = InvokeResponse(
+        source=chat.__name__,
+        state=True
+    )
+
+    with trace_request("chat"):
+        ensure_graph_result = await ensure_graph(doc_config)
+        if not ensure_graph_result.state:
+            result.state = False
+            result.message = ensure_graph_result.message
             return vars(result)
 
-    qa_result = qa_answer(current_doc_config, request.question)
+        qa_result = await qa_answer(doc_config, request.question)
 
     if qa_result.state and qa_result.addition_args is not None:
-        current_doc_config.chat_history = qa_result.addition_args["response"]["messages"]
         role = qa_result.addition_args["response"]["messages"][-1].type
         message = qa_result.addition_args["response"]["messages"][-1].content
-        result.addition_args = {"role": role, "message": message}
+        result.addition_args = {"role": role, "message": message, "cache_hit": qa_result.addition_args["cache_hit"]}
 
     result.state = qa_result.state
     result.message = qa_result.source+": "+qa_result.message
     
     return vars(result)
+
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest, doc_config: DocConfig = Depends(get_current_doc_config)):
+    """以SSE逐字返回回复，事件依次为sources、token、done，出错时为error"""
+
+    ensure_graph_result = await ensure_graph(doc_config)
+    if not ensure_graph_result.state:
+        return StreamingResponse(iter([sse_event("error", {"message": ensure_graph_result.message})]), media_type="text/event-stream")
+
+    graph = doc_config.graph["graph"]  # type: ignore[index]
+    graph_config = doc_config.graph["graph_config"]  # type: ignore[index]
+    graph_context = doc_config.graph["graph_context"]  # type: ignore[index]
+
+    async def event_stream() -> AsyncIterator[str]:
+        # 同一会话的上一轮回复结束后才开始这一轮
+        with trace_request("chat_stream"):
+            async with doc_config.turn_lock:
+                async for event in chat_events():
+                    yield event
+
+    async def chat_events() -> AsyncIterator[str]:
+        try:
+            # 语义缓存命中时直接返回之前的回答
+            cache_result = await lookup_cached_answer(doc_config, request.question)
+            if cache_result.state and cache_result.addition_args is not None:
+                messages = cache_result.addition_args["response"]["messages"]
+                yield sse_event("sources", {"sources": cache_result.addition_args["sources"]})
+                yield sse_event("token", {"content": messages[-1].content})
+                yield sse_event("done", {"role": messages[-1].type, "message": messages[-1].content, "cache_hit": True})
+                return
+
+            values = None
+            graph_input = build_graph_input(doc_config, request.question)
+            async for mode, chunk in graph.astream(graph_input, config=graph_config, context=graph_context, stream_mode=["updates", "messages", "values"]):
+                if mode == "values":
+                    values = chunk
+                elif mode == "updates" and "retrieve_node" in chunk:
+                    # 检索完成后先把来源发给前端
+                    sources = []
+                    for message in chunk["retrieve_node"]["messages"]:
+                        sources.extend(getattr(message, "artifact", None) or [])
+                    yield sse_event("sources", {"sources": sources})
+                elif mode == "messages":
+                    # 只转发generate_node中LLM生成的token，retrieve_node里翻译query的输出不发给前端
+                    message, metadata = chunk
+                    if metadata.get("langgraph_node") == "generate_node" and isinstance(message, AIMessageChunk) and message.content:
+                        yield sse_event("token", {"content": message.content})
+
+            await save_turn(doc_config, graph_input, values)
+            messages = values["messages"]  # type: ignore[index]
+            remember_answer(doc_config, request.question, (cache_result.addition_args or {}).get("question_vector"), messages)
+            yield sse_event("done", {"role": messages[-1].type, "message": messages[-1].content, "cache_hit": False})
+        except Exception as e:
+            yield sse_event("error", {"message": f"{chat_stream.__name__}: 模型响应失败！\n{e}"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/chat/answer_cache")
+async def answer_cache_stats():
+    result = InvokeResponse(
+        source=answer_cache_stats.__name__,
+        state=True,
+        addition_args=answer_cache.stats()
+    )
+
+    return vars(result)
@@ -0,0 +1,134 @@
+import asyncio
+from typing import List, Optional
+
+from pydantic import BaseModel
+from fastapi import APIRouter, Depends
+
+from rag.corpus import list_corpus_documents, corpus_search
+from rag.history import history_store
+from schemas.DocQA_types import DocConfig, InvokeResponse
+from extension import get_current_doc_config
+from config import retrieval_k
+
+
+router = APIRouter()
+
+
+class CorpusSelection(BaseModel):
+    # 为空时退出跨文档模式，回到当前文档
+    doc_ids: Optional[List[str]] = None
+
+
+class CorpusSearchRequest(BaseModel):
+    question: str
+    doc_ids: Optional[List[str]] = None
+    k: int = retrieval_k
+
+
+def session_corpus_documents(doc_config: DocConfig):
+    # 只能检索本会话上传过的文档：历史记录中的文档和当前文档
+    file_hashes = {document["file_hash"] for document in history_store.list_documents(doc_config.session_id)}  # type: ignore[arg-type]
+    if doc_config.file_hash is not None:
+        file_hashes.add(doc_config.file_hash)
+    # 只能在用同一编码模型构建的文档之间检索
+    return list_corpus_documents(doc_config.embedding_model_name, file_hashes)
+
+
+@router.get("/corpus")
+async def list_corpus(doc_config: DocConfig = Depends(get_current_doc_config)):
+    result = InvokeResponse(
+        source=list_corpus.__name__,
+        state=True,
+        message="成功获取文档库！"
+    )
+
+    documents = await asyncio.to_thread(session_corpus_documents, doc_config)
+    selected = {document["doc_id"] for document in doc_config.corpus_documents or []}
+    result.addition_args = {
+        "documents": [
+            {key: document[key] for key in ("doc_id", "file_name", "chunk_count", "vector_store_backend")} | {"selected": document["doc_id"] in selected}
+            for document in documents
+        ]
+    }
+
+    return vars(result)
+
+
+@router.post("/corpus/select")
+async def select_corpus(selection: CorpusSelection, doc_config: DocConfig = Depends(get_current_doc_config)):
+    result = InvokeResponse(
+        source=select_corpus.__name__,
+        state=True,
+        message="已切换到跨文档问答！"
+    )
+
+    if doc_config.embedding_model is None:
+        result.state = False
+        result.message = "请先配置embedding model!"
+        return vars(result)
+
+    if selection.doc_ids:
+        documents = [
+            document for document in await asyncio.to_thread(session_corpus_documents, doc_config)
+            if document["doc_id"] in selection.doc_ids
+        ]
+        if len(documents) != len(set(selection.doc_ids)):
+            result.state = False
+            result.message = "部分文档不存在或不是用当前编码模型构建的！"
+            return vars(result)
+        doc_config.corpus_documents = documents
+    else:
+        doc_config.corpus_documents = None
+        result.message = "已回到当前文档！"
+
+    # 换成另一组文档的对话线程，graph需要重新构建
+    doc_config.thread_id = None
+    doc_config.chat_history = []
+    doc_config.chat_summary = ""
+    doc_config.graph = None
+
+    result.addition_args = {
+        "documents": [{"doc_id": document["doc_id"], "file_name": document["file_name"]} for document in doc_config.corpus_documents or []]
+    }
+
+    return vars(result)
+
+
+@router.post("/corpus/search")
+async def search_corpus(request: CorpusSearchRequest, doc_config: DocConfig = Depends(get_current_doc_config)):
+    result = InvokeResponse(
+        source=search_corpus.__name__,
+        state=True,
+        message="检索成功！"
+    )
+
+    if doc_config.embedding_model is None:
+        result.state = False
+        result.message = "请先配置embedding model!"
+        return vars(result)
+
+    documents = await asyncio.to_thread(session_corpus_documents, doc_config)
+    if request.doc_ids:
+        documents = [document for document in documents if document["doc_id"] in request.doc_ids]
+
+    try:
+        docs = await corpus_search(documents, doc_config.embedding_model, request.question, request.question, request.k)
+    except Exception as e:
+        result.state = False
+        result.message = f"检索失败！\n{e}"
+        return vars(result)
+
+    result.addition_args = {
+        "results": [
+            {
+                "doc_id": doc.metadata.get("doc_id"),
+                "file_name": doc.metadata.get("file_name"),
+                "page": doc.metadata.get("page"),
+                "page_label": doc.metadata.get("page_label"),
+                "content": doc.page_content
+            }
+            for doc in docs
+        ]
+    }
+
+    return vars(result)
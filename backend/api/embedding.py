@@ -1,40 +1,67 @@
-from fastapi import APIRouter
-from rag.vector import load_and_index_pdf
+from fastapi import APIRouter, Depends
 
-from schemas.DocQA_types import InvokeResponse
-from extension import current_doc_config
+from rag.ingest import submit_ingest_job, get_ingest_job, cancel_ingest_job
+from schemas.DocQA_types import DocConfig, InvokeResponse
+from extension import get_current_doc_config
 
 
 router = APIRouter()
 
 
 @router.post("/embedding")
-async def embed_file():
+async def embed_file(doc_config: DocConfig = Depends(get_current_doc_config)):
     result = InvokeResponse(
         source=embed_file.__name__,
         state=True,
-        message="构建向量库成功！"
+        message="已开始构建向量库！"
     )
 
     # 未上传文件
-    if current_doc_config.tmp_file_path is None:
+    if doc_config.tmp_file_path is None:
         result.state = False
         result.message = "请先上传文件！"
         return vars(result)
 
-    # 构建向量库
-    index_result = load_and_index_pdf(current_doc_config.tmp_file_path)
+    # 在后台构建向量库，立刻返回任务id，前端通过/embedding/{job_id}查询进度
+    job = submit_ingest_job(doc_config)
+    result.addition_args = job.model_dump(exclude={"addition_args"})
 
-    if index_result.state and index_result.addition_args is not None:
-        current_doc_config.vector_store = index_result.addition_args["vector_store"]
-        current_doc_config.vector_cache_path = index_result.addition_args["vector_store_cache_path"]
-        result.addition_args = { "vector_store_cache_path": current_doc_config.vector_cache_path }
-    else:
+    return vars(result)
+
+
+@router.get("/embedding/{job_id}")
+async def embed_file_status(job_id: str):
+    result = InvokeResponse(
+        source=embed_file_status.__name__,
+        state=True
+    )
+
+    job = get_ingest_job(job_id)
+    if job is None:
+        result.state = False
+        result.message = "任务不存在！"
+        return vars(result)
+
+    result.message = job.message
+    result.addition_args = {**job.model_dump(exclude={"addition_args"}), **(job.addition_args or {})}
+
+    return vars(result)
+
+
+@router.delete("/embedding/{job_id}")
+async def cancel_embed_file(job_id: str):
+    result = InvokeResponse(
+        source=cancel_embed_file.__name__,
+        state=True,
+        message="已请求取消构建向量库。"
+    )
+
+    job = cancel_ingest_job(job_id)
+    if job is None:
         result.state = False
-        result.message = index_result.source+": "+index_result.message
+        result.message = "任务不存在！"
         return vars(result)
 
-    result.state = index_result.state
-    result.message = index_result.source+": "+index_result.message
+    result.addition_args = job.model_dump(exclude={"addition_args"})
 
     return vars(result)
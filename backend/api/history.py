@@ -0,0 +1,101 @@
+import os
+import asyncio
+
+from fastapi import APIRouter, Depends
+
+from rag.history import history_store
+from rag.vector import load_existing_index
+from schemas.DocQA_types import InvokeResponse
+from extension import session_registry, get_session_id
+
+
+router = APIRouter()
+
+
+# 会话代表不同的用户，只能看到、打开自己会话中的记录
+@router.get("/history")
+async def list_history(session_id: str = Depends(get_session_id)):
+    result = InvokeResponse(
+        source=list_history.__name__,
+        state=True,
+        message="成功获取历史记录！"
+    )
+
+    result.addition_args = {"documents": await asyncio.to_thread(history_store.list_documents, session_id)}
+
+    return vars(result)
+
+
+@router.get("/history/{thread_id}")
+async def get_history(thread_id: str, session_id: str = Depends(get_session_id)):
+    result = InvokeResponse(
+        source=get_history.__name__,
+        state=True,
+        message="成功获取对话记录！"
+    )
+
+    document = await asyncio.to_thread(history_store.get_document, thread_id, session_id)
+    if document is None:
+        result.state = False
+        result.message = "历史记录不存在！"
+        return vars(result)
+
+    messages = await asyncio.to_thread(history_store.load_messages, thread_id)
+    result.addition_args = {
+        **document,
+        "chat_history": [{"role": message.type, "message": message.content} for message in messages if message.type in ("human", "ai") and message.content]
+    }
+
+    return vars(result)
+
+
+@router.post("/history/{thread_id}/open")
+async def open_history(thread_id: str, session_id: str = Depends(get_session_id)):
+    result = InvokeResponse(
+        source=open_history.__name__,
+        state=True,
+        message="已恢复历史文档！"
+    )
+
+    document = await asyncio.to_thread(history_store.get_document, thread_id, session_id)
+    if document is None:
+        result.state = False
+        result.message = "历史记录不存在！"
+        return vars(result)
+
+    if document["tmp_file_path"] is None or not os.path.exists(document["tmp_file_path"]):
+        result.state = False
+        result.message = "历史文档的文件已不存在！"
+        return vars(result)
+
+    # 换成历史文档，保留当前会话的模型配置
+    doc_config = session_registry.reset(session_id)
+    doc_config.file_name = document["file_name"]
+    doc_config.tmp_file_path = document["tmp_file_path"]
+    doc_config.lanuage = document["lanuage"]
+    doc_config.thread_id = thread_id
+    doc_config.chat_history = await asyncio.to_thread(history_store.load_messages, thread_id)
+    doc_config.chat_summary = document["summary"]
+
+    # 向量库和当前的编码模型匹配时直接打开，否则需要重新构建
+    index_reused = False
+    if document["file_hash"] is not None:
+        index_result = await asyncio.to_thread(load_existing_index, document["tmp_file_path"], document["file_hash"], doc_config.embedding_model, doc_config.embedding_model_name, doc_config.vector_store_backend)
+        if index_result.state and index_result.addition_args is not None:
+            doc_config.vector_store = index_result.addition_args["vector_store"]
+            doc_config.lexical_index = index_result.addition_args["lexical_index"]
+            doc_config.vector_cache_path = index_result.addition_args["vector_store_cache_path"]
+            doc_config.file_hash = document["file_hash"]
+            index_reused = True
+
+    result.addition_args = {
+        "file_name": doc_config.file_name,
+        "tmp_file_path": doc_config.tmp_file_path,
+        "thread_id": thread_id,
+        "message_count": len(doc_config.chat_history),
+        "index_reused": index_reused
+    }
+    if not index_reused:
+        result.message = "已恢复历史文档，请重新构建向量库！"
+
+    return vars(result)
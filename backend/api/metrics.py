@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from rag.metrics import metrics, Gauge
+from rag.answer_cache import answer_cache
+from rag.vector import opened_vector_stores
+from extension import session_registry
+
+
+router = APIRouter()
+
+# 当前状态在导出时读取
+metrics.register(Gauge("docqa_sessions", "当前的会话数", lambda: len(session_registry)))
+metrics.register(Gauge("docqa_open_vector_stores", "已打开的向量库数", lambda: len(opened_vector_stores)))
+metrics.register(Gauge("docqa_answer_cache_entries", "语义缓存中的回答数", lambda: answer_cache.stats()["entries"]))
+
+
+@router.get("/metrics")
+async def export_metrics():
+    # Prometheus文本格式，不套InvokeResponse，方便直接抓取
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
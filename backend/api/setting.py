@@ -1,11 +1,11 @@
 from typing import Optional
 from pydantic import BaseModel, SecretStr
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
 from rag.models import build_llm
-from rag.vector import build_embedding_model
-from schemas.DocQA_types import InvokeResponse
-from extension import current_doc_config
+from rag.vector import build_embedding_model, vector_store_backends
+from schemas.DocQA_types import DocConfig, InvokeResponse
+from extension import get_current_doc_config
 
 
 router = APIRouter()
@@ -15,6 +15,10 @@ class LanuageConfig(BaseModel):
     lanuage: str
 
 
+class VectorStoreConfig(BaseModel):
+    vector_store_backend: str
+
+
 class ModelConfig(BaseModel):
     embedding_model_name: str
     embedding_model_api_key: Optional[SecretStr] = None
@@ -23,29 +27,30 @@ class ModelConfig(BaseModel):
 
 
 @router.post("/set_models")
-def config_set_model(model_setting: ModelConfig):
+def config_set_model(model_setting: ModelConfig, doc_config: DocConfig = Depends(get_current_doc_config)):
     result = InvokeResponse(
         source=config_set_model.__name__,
         state=True,
         message="配置模型成功！"
     )
 
-    if model_setting.llm_name != current_doc_config.llm_name or model_setting.llm_api_key != current_doc_config.llm_api_key:
+    if model_setting.llm_name != doc_config.llm_name or model_setting.llm_api_key != doc_config.llm_api_key:
         build_llm_result = build_llm(model_setting.llm_name, model_setting.llm_api_key)
         if build_llm_result.state and build_llm_result.addition_args is not None:
-            current_doc_config.llm_name = build_llm_result.addition_args["llm_name"]
-            current_doc_config.llm_model = build_llm_result.addition_args["llm"]
-            current_doc_config.llm_api_key = model_setting.llm_api_key
+            doc_config.llm_name = build_llm_result.addition_args["llm_name"]
+            doc_config.llm_model = build_llm_result.addition_args["llm"]
+            doc_config.llm_api_key = model_setting.llm_api_key
         else:
             result.state = False
             result.message = build_llm_result.source+": "+build_llm_result.message
             return vars(result)
 
-    if model_setting.embedding_model_name != current_doc_config.embedding_model_name or model_setting.embedding_model_api_key != current_doc_config.embedding_model_api_key:
+    if model_setting.embedding_model_name != doc_config.embedding_model_name or model_setting.embedding_model_api_key != doc_config.embedding_model_api_key:
         build_embedding_model_result = build_embedding_model(model_setting.embedding_model_name, model_setting.embedding_model_api_key)
         if build_embedding_model_result.state and build_embedding_model_result.addition_args is not None:
-            current_doc_config.embedding_model_name = build_embedding_model_result.addition_args["embedding_model_name"]
-            current_doc_config.embedding_model = build_embedding_model_result.addition_args["embedding_model"]
+            doc_config.embedding_model_name = build_embedding_model_result.addition_args["embedding_model_name"]
+            doc_config.embedding_model = build_embedding_model_result.addition_args["embedding_model"]
+            doc_config.embedding_model_api_key = model_setting.embedding_model_api_key
         else:
             result.state = False
             result.message = build_embedding_model_result.source+": "+build_embedding_model_result.message
@@ -55,7 +60,7 @@ def config_set_model(model_setting: ModelConfig):
 
 
 @router.post("/set_lanuage")
-def config_set_lanuage(lanuage_setting: LanuageConfig):
+def config_set_lanuage(lanuage_setting: LanuageConfig, doc_config: DocConfig = Depends(get_current_doc_config)):
     result = InvokeResponse(
         source=config_set_lanuage.__name__,
         state=True,
@@ -63,9 +68,31 @@ def config_set_lanuage(lanuage_setting: LanuageConfig):
     )
 
     if len(lanuage_setting.lanuage) > 0:
-        current_doc_config.lanuage = lanuage_setting.lanuage
+        doc_config.lanuage = lanuage_setting.lanuage
     else:
         result.state = False
         result.message = "未设置语言！"
 
     return vars(result)
+
+
+@router.post("/set_vector_store")
+def config_set_vector_store(vector_store_setting: VectorStoreConfig, doc_config: DocConfig = Depends(get_current_doc_config)):
+    result = InvokeResponse(
+        source=config_set_vector_store.__name__,
+        state=True,
+        message=f"已设置为{vector_store_setting.vector_store_backend}"
+    )
+
+    if vector_store_setting.vector_store_backend not in vector_store_backends:
+        result.state = False
+        result.message = f"暂不支持{vector_store_setting.vector_store_backend}！可选：{', '.join(vector_store_backends)}"
+        return vars(result)
+
+    if vector_store_setting.vector_store_backend != doc_config.vector_store_backend:
+        doc_config.vector_store_backend = vector_store_setting.vector_store_backend
+        # 已构建的向量库用的是原来的后端，需要重新构建
+        if doc_config.vector_store is not None:
+            result.message += "，请重新构建向量库！"
+
+    return vars(result)
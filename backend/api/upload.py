@@ -1,118 +1,221 @@
 import os
-import shutil
-import json
+import uuid
+import hashlib
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, UploadFile, File
+import anyio
+from fastapi import APIRouter, Depends, Request
+from python_multipart.multipart import MultipartParser, parse_options_header
 
+from rag.metrics import span
 from schemas.DocQA_types import DocConfig, InvokeResponse
-from config import temp_file_path, history_docs_path
-from extension import current_doc_config, InitDocConfig
+from config import temp_file_path, max_upload_size, upload_chunk_size, upload_form_overhead
+from extension import session_registry, get_session_id, get_current_doc_config
 
 
 router = APIRouter()
 
 
-# 将上传的文件保存在一个临时文件中
-async def save_tmp_upload_file(file: UploadFile):
+def stored_upload_path(file_hash: str):
+    # 文件按内容hash存放在各自的目录下，内容相同的文件只保存一份
+    directory = os.path.join(temp_file_path, file_hash)
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            return os.path.join(directory, name)
+    return None
+
+
+def remove_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def store_upload_file(part_path: str, file_hash: str, file_name: str) -> str:
+    # 内容相同的文件已经保存过时直接使用已有的文件
+    tmp_path = stored_upload_path(file_hash)
+    if tmp_path is None:
+        tmp_path = os.path.join(temp_file_path, file_hash, file_name)
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        os.replace(part_path, tmp_path)
+    return tmp_path
+
+
+class UploadPartParser:
+    """解析multipart请求体的回调，只收集名为file的文件字段的内容
+
+    回调中不能await，解析出的数据先放在data中，由调用方写入文件。
+    """
+
+    def __init__(self):
+        self.file_name: Optional[str] = None
+        self.data: List[bytes] = []
+        self.finished = False
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._in_file = False
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        # 只取第一个文件字段，其余字段忽略
+        self._in_file = self.file_name is None and options.get(b"name") == b"file" and b"filename" in options
+        if self._in_file:
+            self.file_name = options[b"filename"].decode("utf-8", errors="replace")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self.data.append(data[start:end])
+
+    def on_part_end(self):
+        if self._in_file:
+            self.finished = True
+            self._in_file = False
+
+
+# 直接解析请求体，文件内容分块写入临时文件，边写边计算hash，超过大小上限时立即停止读取
+async def save_tmp_upload_file(request: Request):
     result = InvokeResponse(
         source=save_tmp_upload_file.__name__,
         state=True,
         message="成功缓存文件！"
     )
 
-    if file.filename is not None:
-        tmp_path = os.path.join(temp_file_path, file.filename)
-        with open(tmp_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-        result.addition_args = { "tmp_file_path": tmp_path }
-    else:
+    too_large_message = f"文件超过{max_upload_size // 1024 // 1024}MB的上限！"
+
+    # 请求中带有长度时，不必读取请求体就能拒绝
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_upload_size + upload_form_overhead:
         result.state = False
-        result.message = "上传的文件没有文件名！"
+        result.message = too_large_message
+        return result
 
-    return result
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        result.state = False
+        result.message = "请以multipart/form-data格式上传文件！"
+        return result
+
+    part = UploadPartParser()
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": part.on_part_begin,
+        "on_header_field": part.on_header_field,
+        "on_header_value": part.on_header_value,
+        "on_header_end": part.on_header_end,
+        "on_headers_finished": part.on_headers_finished,
+        "on_part_data": part.on_part_data,
+        "on_part_end": part.on_part_end
+    })
+
+    part_path = os.path.join(temp_file_path, f".{uuid.uuid4().hex}.part")
+    sha256 = hashlib.sha256()
+    size = 0
+
+    try:
+        with span("upload_save") as record:
+            async with await anyio.open_file(part_path, "wb") as f:
+                buffer = bytearray()
+                async for chunk in request.stream():
+                    parser.write(chunk)
+                    for data in part.data:
+                        size += len(data)
+                        if size > max_upload_size:
+                            result.state = False
+                            result.message = too_large_message
+                            return result
+                        sha256.update(data)
+                        buffer += data
+                    part.data.clear()
+                    # 请求体的块通常较小，攒够upload_chunk_size再写入，减少线程切换
+                    if len(buffer) >= upload_chunk_size:
+                        await f.write(bytes(buffer))
+                        buffer.clear()
+                    if part.finished:
+                        break
+                if buffer:
+                    await f.write(bytes(buffer))
+            record.set(bytes=size)
+
+        if part.file_name is None or not part.finished:
+            result.state = False
+            result.message = "没有收到完整的文件！"
+            return result
 
+        file_name = os.path.basename(part.file_name)
+        if not file_name:
+            result.state = False
+            result.message = "上传的文件没有文件名！"
+            return result
 
-def save_current_doc(current_doc_content: DocConfig):
-    result = InvokeResponse(
-        source=save_current_doc.__name__,
-        state=True,
-        message="已保存上一文档记录！"
-    )
+        file_hash = sha256.hexdigest()
+        tmp_path = await anyio.to_thread.run_sync(store_upload_file, part_path, file_hash, file_name)
+    finally:
+        await anyio.to_thread.run_sync(remove_file, part_path)
 
-    if current_doc_content.file_name is not None:
-        try:
-            save_history_path = os.path.join(history_docs_path, current_doc_content.file_name).replace("pdf", "json")
-            save_data = {
-                "file_name": current_doc_content.file_name,
-                "tmp_file_path": current_doc_content.tmp_file_path,
-                "lanuage": current_doc_content.lanuage,
-                "embedding_model_name": current_doc_content.embedding_model_name,
-                "llm_name": current_doc_content.llm_name,
-                "vector_cache_path": current_doc_content.vector_cache_path
-            }
-
-            chat_history = []
-            if current_doc_content.chat_history is not None and len(current_doc_content.chat_history):
-                for message in current_doc_content.chat_history:
-                    chat_history.append({"role": message.type, "message": message.content})
-            save_data["chat_history"] = chat_history
-
-            with open(save_history_path, "w", encoding="utf-8") as f:
-                json.dump(save_data, f, indent=4, ensure_ascii=False)
-            
-            result.addition_args = { "save_path": f"成功保存聊天记录到{save_history_path}" }
-        except Exception as e:
-            result.state = False
-            result.message = str(e)
-            result.addition_args = { "error": e }
-    else:
-        result.message = "没有文件。"
+    result.addition_args = {
+        "file_name": file_name,
+        "tmp_file_path": tmp_path,
+        "file_hash": file_hash,
+        "size": size
+    }
 
     return result
 
 
 @router.post("/upload")
-async def upload(file: UploadFile = File(...)):
+async def upload(request: Request, session_id: str = Depends(get_session_id), current_doc_config: DocConfig = Depends(get_current_doc_config)):
     result = InvokeResponse(
         source=upload.__name__,
         state=True,
         message="上传成功！"
     )
 
-    if file.filename == current_doc_config.file_name:
-        result.message = "上传文件与当前文件同名，视为相同，后端不再更新文件和向量库！"
-        result.addition_args = {
-            "file_name": current_doc_config.file_name,
-            "tmp_file_path": current_doc_config.tmp_file_path
-        }
-        return vars(result)
-    
-    # 先保存当前文档的记录
-    save_result = save_current_doc(current_doc_config)
-        
-    # 清空原来的文档配置
-    InitDocConfig()
-
     # 等待保存临时文件
-    tmp_result = await save_tmp_upload_file(file)
+    tmp_result = await save_tmp_upload_file(request)
     if tmp_result.state and tmp_result.addition_args is not None:
+        file_name = tmp_result.addition_args["file_name"]
         tmp_path = tmp_result.addition_args["tmp_file_path"]
+        file_hash = tmp_result.addition_args["file_hash"]
     else:
         result.state = False
         result.message = tmp_result.source+": "+tmp_result.message
         return vars(result)
 
-    # 关闭文件
-    await file.close()
+    # 按内容判断是否为同一文件，同名但内容不同的文件按新文件处理
+    if file_hash == current_doc_config.file_hash and current_doc_config.tmp_file_path is not None:
+        result.message = "上传文件与当前文件内容相同，后端不再更新文件和向量库！"
+        result.addition_args = {
+            "file_name": current_doc_config.file_name,
+            "tmp_file_path": current_doc_config.tmp_file_path,
+            "file_hash": file_hash
+        }
+        return vars(result)
+
+    # 对话记录已按轮保存在历史记录中，直接清空原来的文档配置，保留模型配置
+    current_doc_config = session_registry.reset(session_id)
 
-    # 记录文件名
-    current_doc_config.file_name = file.filename
+    # 记录文件名和hash，构建向量库时按hash复用已有的向量库
+    current_doc_config.file_name = file_name
     current_doc_config.tmp_file_path = tmp_path
+    current_doc_config.file_hash = file_hash
 
     result.addition_args = {
         "file_name": current_doc_config.file_name,
         "tmp_file_path": tmp_path,
-        "save_last_file_result": save_result.state if save_result.state else save_result.source+": "+save_result.message
+        "file_hash": file_hash
     }
 
     return vars(result)
@@ -0,0 +1,132 @@
+"""检查同名文档新版本的增量入库：只编码改动的片段，结果与完整重建一致，旧版本的向量库不被修改，
+被取代后不再参与检索，没有会话使用时被删除
+
+在backend目录下运行：python -m bench.incremental_reindex --backends chroma numpy_int8
+任何一项检查不通过时以非零状态退出。
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+from typing import List
+
+import numpy as np
+
+from bench.run import use_temp_paths
+from bench.pdfgen import write_synthetic_pdf
+from bench.fakes import FakeEmbeddings
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    """记录实际编码的片段数"""
+
+    embedded: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+def stored_vectors(vector_store, ids: List[str]) -> np.ndarray:
+    from rag.numpy_store import NumpyVectorStore
+
+    collection = vector_store if isinstance(vector_store, NumpyVectorStore) else vector_store._collection
+    stored = collection.get(ids=ids, include=["embeddings"])
+    vectors = dict(zip(stored["ids"], stored["embeddings"]))
+    matrix = np.asarray([vectors[doc_id] for doc_id in ids], dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def check(name: str, passed: bool) -> bool:
+    print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+    return passed
+
+
+def run_backend(tmp_dir: str, backend: str, pages: int) -> bool:
+    from pypdf import PdfReader, PdfWriter
+    from rag.vector import load_and_index_pdf, read_manifest, remove_superseded_indexes
+    from rag.corpus import list_corpus_documents
+
+    print(f"--- {backend}")
+    base_path = os.path.join(tmp_dir, f"{backend}_base.pdf")
+    other_path = os.path.join(tmp_dir, f"{backend}_other.pdf")
+    write_synthetic_pdf(base_path, pages, seed=0)
+    write_synthetic_pdf(other_path, pages, seed=1)
+
+    # 新版本：替换两页，去掉最后一页
+    base, other, writer = PdfReader(base_path), PdfReader(other_path), PdfWriter()
+    changed_pages = (pages // 4, pages // 2)
+    for i, page in enumerate(base.pages[:-1]):
+        writer.add_page(other.pages[i] if i in changed_pages else page)
+    v2_path = os.path.join(tmp_dir, f"{backend}_v2.pdf")
+    writer.write(v2_path)
+
+    # 上传的文件都叫spec.pdf，各版本放在不同目录，和上传接口保存文件的方式一致
+    def upload(src: str, version: str) -> str:
+        os.makedirs(os.path.join(tmp_dir, backend, version))
+        return shutil.copy(src, os.path.join(tmp_dir, backend, version, "spec.pdf"))
+
+    # 编码缓存按模型名区分，每个后端用自己的模型名，编码数不受前面后端的影响
+    embeddings = CountingEmbeddings(size=64)
+    model_name = f"fake-{backend}"
+    v1 = load_and_index_pdf(upload(base_path, "v1"), embeddings, model_name, vector_store_backend=backend).addition_args
+    v1_store = v1["vector_store"]  # type: ignore[index]
+    v1_ids = sorted(v1_store.get(include=[])["ids"])
+    v1_vectors = stored_vectors(v1_store, v1_ids)
+
+    embeddings.embedded = 0
+    v2 = load_and_index_pdf(upload(v2_path, "v2"), embeddings, model_name, vector_store_backend=backend).addition_args
+    v2_embedded = embeddings.embedded
+
+    # 用另一个编码模型名构建到另一个目录，不会找到旧版本，作为完整重建的对照
+    full = load_and_index_pdf(upload(v2_path, "full"), CountingEmbeddings(size=64), f"{model_name}-full", vector_store_backend=backend).addition_args
+
+    v2_ids = sorted(v2["vector_store"].get(include=[])["ids"])  # type: ignore[index]
+    full_ids = sorted(full["vector_store"].get(include=[])["ids"])  # type: ignore[index]
+    kept_ids = sorted(set(v1_ids) & set(v2_ids))
+
+    print(f"  v1 {len(v1_ids)} chunks, v2 added {v2['chunks_added']} kept {v2['chunks_kept']} deleted {v2['chunks_deleted']}")  # type: ignore[index]
+    results = [
+        check("incremental update detected", v2["incremental"]),  # type: ignore[index]
+        check("written to a new directory", v2["vector_store_cache_path"] != v1["vector_store_cache_path"]),  # type: ignore[index]
+        check("same chunk ids as a full rebuild", v2_ids == full_ids),
+        check("lexical index has the same ids", sorted(v2["lexical_index"].ids) == full_ids),  # type: ignore[index]
+        check("only changed chunks embedded", v2_embedded == v2["chunks_added"] == len(set(v2_ids) - set(v1_ids))),  # type: ignore[index]
+        check("kept and deleted counts match the id diff", v2["chunks_kept"] == len(kept_ids) and v2["chunks_deleted"] == len(set(v1_ids) - set(v2_ids))),  # type: ignore[index]
+        check("kept vectors copied unchanged", np.allclose(stored_vectors(v2["vector_store"], kept_ids), stored_vectors(full["vector_store"], kept_ids), atol=1e-2)),  # type: ignore[index]
+        check("previous version untouched", sorted(v1_store.get(include=[])["ids"]) == v1_ids and np.array_equal(stored_vectors(v1_store, v1_ids), v1_vectors)),
+    ]
+
+    v1_path = v1["vector_store_cache_path"]  # type: ignore[index]
+    corpus_paths = [document["vector_cache_path"] for document in list_corpus_documents(model_name)]
+    results += [
+        check("previous version marked superseded", read_manifest(v1_path).get("superseded_by") == v2["file_hash"]),  # type: ignore[index,union-attr]
+        check("superseded version left out of the corpus", corpus_paths == [v2["vector_store_cache_path"]]),  # type: ignore[index]
+    ]
+    remove_superseded_indexes([v1_path])
+    results.append(check("superseded version kept while in use", os.path.exists(v1_path)))
+    remove_superseded_indexes([])
+    results.append(check("superseded version removed once unused", not os.path.exists(v1_path) and os.path.exists(v2["vector_store_cache_path"])))  # type: ignore[index]
+
+    # 旧版本删除后重新上传，能在原目录重新构建
+    v1_again = load_and_index_pdf(upload(base_path, "v1_again"), embeddings, model_name, vector_store_backend=backend).addition_args
+    results.append(check("removed version can be rebuilt", v1_again["vector_store_cache_path"] == v1_path and sorted(v1_again["vector_store"].get(include=[])["ids"]) == v1_ids))  # type: ignore[index]
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["chroma", "numpy_float32", "numpy_int8"])
+    parser.add_argument("--pages", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        use_temp_paths(tmp_dir)
+        passed = all([run_backend(tmp_dir, backend, args.pages) for backend in args.backends])
+
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
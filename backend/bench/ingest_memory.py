@@ -0,0 +1,109 @@
+"""对比一次性加载与逐页流水线两种入库方式的峰值内存随页数的增长
+
+在backend目录下运行：python -m bench.ingest_memory --pages 100 300 1000 3000
+每次运行都在新的子进程中进行，同时记录python分配的峰值（tracemalloc）和进程峰值RSS相对运行前的增量，
+并给出相对最小页数的增长量。逐页流水线固定为单进程解析，两种方式都只在被测进程内解析PDF。
+"""
+import os
+import time
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+from typing import Any, Dict, List
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from bench.pdfgen import write_synthetic_pdf
+import rag.vector
+from rag.vector import iter_pdf_pages, iter_chunks, iter_batches, add_documents_in_batches
+from config import chunk_size, chunk_overlap, embedding_batch_size
+
+
+class NullCollection:
+    def upsert(self, **kwargs):
+        pass
+
+
+class NullVectorStore:
+    """丢弃写入的向量，只测量加载、分割、编码这一段的内存"""
+    _collection = NullCollection()
+
+
+def run_eager(file_path: str, embeddings):
+    docs = PyPDFLoader(file_path).load()
+    splits = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_documents(docs)
+    batches = [splits[i:i + embedding_batch_size] for i in range(0, len(splits), embedding_batch_size)]
+    return add_documents_in_batches(NullVectorStore(), embeddings, batches)  # type: ignore[arg-type]
+
+
+def run_streaming(file_path: str, embeddings):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = iter_chunks(iter_pdf_pages(file_path), text_splitter)
+    return add_documents_in_batches(NullVectorStore(), embeddings, iter_batches(chunks, embedding_batch_size))  # type: ignore[arg-type]
+
+
+MODES = {"eager": run_eager, "streaming": run_streaming}
+
+
+def measure_in_process(mode: str, file_path: str, results):
+    # 多进程解析的内存在子进程里，tracemalloc和本进程的RSS都看不到，这里固定为单进程解析
+    rag.vector.pdf_parse_workers = 1
+    embeddings = DeterministicFakeEmbedding(size=256)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunk_count = MODES[mode](file_path, embeddings)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results.put({
+        "chunks": chunk_count,
+        "seconds": elapsed,
+        "traced_mib": peak / 1024 / 1024,
+        "rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - rss_before
+    })
+
+
+def measure(mode: str, file_path: str) -> Dict[str, Any]:
+    # 每次运行用新进程，峰值RSS不受前一次运行的影响
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure_in_process, args=(mode, file_path, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 300, 1000, 3000])
+    args = parser.parse_args()
+
+    runs: Dict[str, List[Dict[str, Any]]] = {mode: [] for mode in MODES}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for pages in args.pages:
+            file_path = os.path.join(tmp_dir, f"synthetic_{pages}.pdf")
+            write_synthetic_pdf(file_path, pages)
+            print(f"--- {pages} pages, {os.path.getsize(file_path) / 1024 / 1024:.1f} MiB")
+            for mode in MODES:
+                result = measure(mode, file_path)
+                runs[mode].append(result)
+                print(f"{mode:<10} chunks={result['chunks']:<8} time={result['seconds']:8.2f}s  "
+                      f"traced={result['traced_mib']:8.1f} MiB  rss={result['rss_mib']:8.1f} MiB")
+
+    # 逐页流水线不保留页文本和片段，剩下的增长主要是pypdf为全部页建立的页树索引
+    print(f"--- growth from {args.pages[0]} to {args.pages[-1]} pages")
+    for mode, results in runs.items():
+        print(f"{mode:<10} traced=+{results[-1]['traced_mib'] - results[0]['traced_mib']:.1f} MiB  "
+              f"rss=+{results[-1]['rss_mib'] - results[0]['rss_mib']:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
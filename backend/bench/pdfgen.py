@@ -0,0 +1,45 @@
+import random
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(file_path: str, pages: int, lines_per_page: int = 45, seed: int = 0):
+    """生成只含英文文本的测试用PDF，同样的参数生成的文件完全一致"""
+
+    rng = random.Random(seed)
+    vocabulary = [
+        "retrieval", "augmented", "generation", "vector", "embedding", "transformer", "attention",
+        "latency", "throughput", "document", "section", "equation", "experiment", "baseline",
+        "model", "result", "table", "figure", "dataset", "accuracy", "the", "of", "and", "a", "in"
+    ]
+
+    offsets = []
+    with open(file_path, "wb") as f:
+        def write_object(number: int, body: bytes):
+            offsets.append((number, f.tell()))
+            f.write(f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+
+        # 1: Catalog, 2: Pages, 3: Font, 之后每页占两个对象（Page和内容流）
+        page_ids = [4 + 2 * i for i in range(pages)]
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+        write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode("latin-1"))
+        write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+        for i, page_id in enumerate(page_ids):
+            lines = [f"Section {i + 1}.{j + 1} " + " ".join(rng.choice(vocabulary) for _ in range(12)) for j in range(lines_per_page)]
+            text = " T*\n".join(f"({_escape(line)}) Tj" for line in lines)
+            stream = f"BT /F1 10 Tf 12 TL 40 800 Td\n{text}\nET".encode("latin-1")
+            write_object(page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode("latin-1"))
+            write_object(page_id + 1, f"<< /Length {len(stream)} >>\nstream\n".encode("latin-1") + stream + b"\nendstream")
+
+        xref_offset = f.tell()
+        object_count = 4 + 2 * pages
+        f.write(f"xref\n0 {object_count}\n0000000000 65535 f \n".encode("latin-1"))
+        for _, offset in sorted(offsets):
+            f.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+        f.write(f"trailer\n<< /Size {object_count} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1"))
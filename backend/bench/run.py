@@ -0,0 +1,308 @@
+"""离线基准测试：用假LLM、假编码模型和生成的PDF测量入库吞吐量、峰值内存，以及经FastAPI问答的延迟和并发吞吐量
+
+结果写成JSON，不同提交的结果可以直接对比。每次入库和问答测试都在独立的进程中进行，峰值内存互不影响。
+在backend目录下运行：python -m bench.run --pages 50 500 --output before.json
+与之前的结果对比：python -m bench.run --output after.json --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bench.pdfgen import write_synthetic_pdf
+from bench.vector_store import rss_mib
+
+
+def use_temp_paths(tmp_dir: str):
+    """在导入rag、api模块之前把数据目录指向临时目录，不读写正式的向量库、缓存和对话记录"""
+
+    import config
+
+    config.temp_file_path = os.path.join(tmp_dir, "Temp")
+    config.vector_cache_path = os.path.join(tmp_dir, "vector_cache_path")
+    config.history_docs_path = os.path.join(tmp_dir, "history")
+    config.embedding_cache_path = os.path.join(tmp_dir, "embedding_cache")
+    config.translation_cache_file = None
+    config.history_db_file = os.path.join(config.history_docs_path, "history.sqlite")
+    # 问题各不相同，语义缓存只会增加查找开销，测的是完整的检索和生成
+    config.answer_cache_enabled = False
+    for path in (config.temp_file_path, config.vector_cache_path, config.history_docs_path, config.embedding_cache_path):
+        os.makedirs(path, exist_ok=True)
+
+
+def peak_rss() -> Dict[str, float]:
+    # Linux上ru_maxrss的单位是KiB，多进程解析PDF时子进程单独统计
+    return {
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_child_rss_mib": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    }
+
+
+def stage_totals() -> Dict[str, Tuple[float, int]]:
+    from rag.metrics import stage_seconds
+    return {labels[0]: totals for labels, totals in stage_seconds.totals().items()}
+
+
+def stage_means_ms(before: Dict[str, Tuple[float, int]], after: Dict[str, Tuple[float, int]]) -> Dict[str, float]:
+    # 两次快照之间各阶段的平均耗时
+    means = {}
+    for stage, (total, count) in sorted(after.items()):
+        total_before, count_before = before.get(stage, (0.0, 0))
+        if count > count_before:
+            means[stage] = round((total - total_before) / (count - count_before) * 1000, 3)
+    return means
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    return round(float(np.percentile(np.array(latencies) * 1000, q)), 3)
+
+
+def run_ingest(file_path: str, pages: int, backend: str, dim: int, embedding_latency: float, tmp_dir: str) -> Dict[str, Any]:
+    use_temp_paths(tmp_dir)
+
+    from bench.fakes import FakeEmbeddings
+    from rag.vector import load_and_index_pdf
+
+    rss_before = rss_mib()
+    start = time.perf_counter()
+    result = load_and_index_pdf(file_path, FakeEmbeddings(size=dim, latency=embedding_latency), "fake", vector_store_backend=backend)
+    elapsed = time.perf_counter() - start
+    assert result.state and result.addition_args is not None, result.message
+
+    chunks = result.addition_args["chunks_added"]
+    return {
+        "pages": pages,
+        "backend": backend,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 1),
+        "chunks_per_s": round(chunks / elapsed, 1),
+        "rss_before_mib": round(rss_before, 1),
+        **peak_rss(),
+        "stage_seconds": {stage: round(total, 3) for stage, (total, _) in stage_totals().items()}
+    }
+
+
+def setup_session(session_id: str, template) -> None:
+    from extension import session_registry
+
+    doc_config = session_registry.get(session_id)
+    for field in ("file_name", "lanuage", "llm_name", "llm_model", "embedding_model_name", "embedding_model", "vector_store", "lexical_index", "vector_cache_path", "file_hash", "vector_store_backend"):
+        setattr(doc_config, field, getattr(template, field))
+
+
+async def chat_once(client, path: str, session_id: str, question: str) -> Tuple[float, Optional[float]]:
+    """返回整个请求的耗时，流式接口另外返回首个token的耗时"""
+
+    headers = {"X-Session-Id": session_id}
+    start = time.perf_counter()
+
+    if path == "/api/chat":
+        response = await client.post(path, json={"question": question}, headers=headers)
+        assert response.json()["state"], response.json()
+        return time.perf_counter() - start, None
+
+    first_token = None
+    async with client.stream("POST", path, json={"question": question}, headers=headers) as response:
+        async for line in response.aiter_lines():
+            assert line != "event: error", line
+            if line == "event: token" and first_token is None:
+                first_token = time.perf_counter() - start
+    return time.perf_counter() - start, first_token
+
+
+async def chat_load(client, path: str, mode: str, concurrency: int, requests: int, template) -> Dict[str, Any]:
+    # 每个并发用户一个会话，依次提问，上一个回答结束再问下一个
+    session_ids = [f"bench-{mode}-{concurrency}-{i}" for i in range(concurrency)]
+    for session_id in session_ids:
+        setup_session(session_id, template)
+    # 预热，各会话先构建graph
+    await asyncio.gather(*(chat_once(client, path, session_id, "warm up") for session_id in session_ids))
+
+    latencies: List[float] = []
+    first_tokens: List[float] = []
+    next_question = iter(range(requests))
+
+    async def user(session_id: str):
+        for i in next_question:
+            latency, first_token = await chat_once(client, path, session_id, f"What does section {i % 50 + 1}.{i % 7 + 1} say about retrieval latency?")
+            latencies.append(latency)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    stages_before = stage_totals()
+    start = time.perf_counter()
+    await asyncio.gather(*(user(session_id) for session_id in session_ids))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99)
+    }
+    if first_tokens:
+        result["first_token_p50_ms"] = percentile_ms(first_tokens, 50)
+        result["first_token_p99_ms"] = percentile_ms(first_tokens, 99)
+    result["stage_mean_ms"] = stage_means_ms(stages_before, stage_totals())
+    return result
+
+
+def run_chat(file_path: str, backend: str, dim: int, llm_latency: float, token_latency: float, concurrency_levels: List[int], requests: int, tmp_dir: str) -> Dict[str, Any]:
+    use_temp_paths(tmp_dir)
+
+    import httpx
+    from fastapi import FastAPI
+
+    from bench.fakes import FakeChatModel, FakeEmbeddings
+    from rag.vector import load_and_index_pdf
+    from schemas.DocQA_types import DocConfig
+    from api import chat
+
+    embeddings = FakeEmbeddings(size=dim)
+    index_result = load_and_index_pdf(file_path, embeddings, "fake", vector_store_backend=backend)
+    assert index_result.state and index_result.addition_args is not None, index_result.message
+
+    template = DocConfig(
+        session_id="template",
+        file_name=os.path.basename(file_path),
+        lanuage="English",
+        llm_name="fake",
+        llm_model=FakeChatModel(latency=llm_latency, token_latency=token_latency),
+        embedding_model_name="fake",
+        embedding_model=embeddings,
+        vector_store=index_result.addition_args["vector_store"],
+        lexical_index=index_result.addition_args["lexical_index"],
+        vector_cache_path=index_result.addition_args["vector_store_cache_path"],
+        file_hash=index_result.addition_args["file_hash"],
+        vector_store_backend=backend
+    )
+
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api")
+
+    async def run() -> List[Dict[str, Any]]:
+        results = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            for mode, path in (("chat", "/api/chat"), ("stream", "/api/chat/stream")):
+                for concurrency in concurrency_levels:
+                    results.append(await chat_load(client, path, mode, concurrency, requests, template))
+        return results
+
+    rss_before = rss_mib()
+    results = asyncio.run(run())
+    return {"backend": backend, "rss_before_mib": round(rss_before, 1), **peak_rss(), "runs": results}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def flatten(results: Dict[str, Any]) -> Dict[str, float]:
+    """把结果展开成"指标路径: 数值"，用于对比两次结果"""
+
+    metrics = {}
+    for run in results.get("ingest", []):
+        for key in ("seconds", "pages_per_s", "chunks_per_s", "peak_rss_mib"):
+            metrics[f"ingest.{run['backend']}.{run['pages']}p.{key}"] = run[key]
+    for run in (results.get("chat") or {}).get("runs", []):
+        for key in ("throughput_rps", "p50_ms", "p99_ms", "first_token_p50_ms"):
+            if key in run:
+                metrics[f"{run['mode']}.c{run['concurrency']}.{key}"] = run[key]
+    return metrics
+
+
+def print_comparison(baseline: Dict[str, Any], results: Dict[str, Any]):
+    old, new = flatten(baseline), flatten(results)
+    print(f"--- 对比 {baseline['meta'].get('commit')} -> {results['meta'].get('commit')}")
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        print(f"{key:<40} {old[key]:>12} {new[key]:>12} {change:+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 500], help="入库测试生成的PDF页数")
+    parser.add_argument("--backends", nargs="+", default=["chroma", "numpy_int8"])
+    parser.add_argument("--dim", type=int, default=256, help="假编码模型的向量维度")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="假编码模型每次请求的耗时（秒）")
+    parser.add_argument("--chat-pages", type=int, default=50, help="问答测试所用文档的页数")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="假LLM每次调用的首字耗时（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="假LLM逐字输出的间隔（秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="每个并发数下的请求数")
+    parser.add_argument("--skip-ingest", action="store_true")
+    parser.add_argument("--skip-chat", action="store_true")
+    parser.add_argument("--output", default=None, help="结果文件，默认为bench_<commit>.json")
+    parser.add_argument("--compare", default=None, help="与之前的结果文件对比")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results: Dict[str, Any] = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        },
+        "ingest": [],
+        "chat": None
+    }
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not args.skip_ingest:
+            for pages in args.pages:
+                file_path = os.path.join(tmp_dir, f"synthetic_{pages}.pdf")
+                write_synthetic_pdf(file_path, pages)
+                for backend in args.backends:
+                    with context.Pool(1) as pool:
+                        run = pool.apply(run_ingest, (file_path, pages, backend, args.dim, args.embedding_latency, tempfile.mkdtemp(dir=tmp_dir)))
+                    results["ingest"].append(run)
+                    print(f"ingest {backend:<14} pages={pages:<6} chunks={run['chunks']:<7} time={run['seconds']:8.2f}s  "
+                          f"{run['pages_per_s']:8.1f} pages/s  {run['chunks_per_s']:8.1f} chunks/s  peak={run['peak_rss_mib']:7.1f} MiB")
+
+        if not args.skip_chat:
+            file_path = os.path.join(tmp_dir, f"chat_{args.chat_pages}.pdf")
+            write_synthetic_pdf(file_path, args.chat_pages, seed=1)
+            with context.Pool(1) as pool:
+                results["chat"] = pool.apply(run_chat, (
+                    file_path, args.backends[0], args.dim, args.llm_latency, args.token_latency, args.concurrency, args.requests, tempfile.mkdtemp(dir=tmp_dir)
+                ))
+            for run in results["chat"]["runs"]:
+                first_token = f"  first_token_p50={run['first_token_p50_ms']:8.1f}ms" if "first_token_p50_ms" in run else ""
+                print(f"{run['mode']:<6} concurrency={run['concurrency']:<4} {run['throughput_rps']:8.2f} req/s  "
+                      f"p50={run['p50_ms']:8.1f}ms  p99={run['p99_ms']:8.1f}ms{first_token}")
+
+    output = args.output or f"bench_{commit or 'unknown'}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入{output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
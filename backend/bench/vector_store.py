@@ -0,0 +1,90 @@
+"""对比chroma与numpy向量库各存储类型的构建时间、检索延迟和常驻内存
+
+每个后端在独立的进程中测量，互不影响内存统计。
+在backend目录下运行：python -m bench.vector_store --chunks 5000 --dim 1536
+"""
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+
+def rss_mib() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def build_backend(backend: str, chunks: int, dim: int, directory: str) -> float:
+    from rag.vector import create_vector_store, upsert_embeddings
+    from rag.numpy_store import NumpyVectorStore
+
+    rng = np.random.default_rng(0)
+    documents = [Document(page_content=f"chunk {i}", metadata={"page": i // 6}, id=f"chunk-{i}") for i in range(chunks)]
+    vectors = rng.standard_normal((chunks, dim), dtype=np.float32)
+
+    start = time.perf_counter()
+    vector_store = create_vector_store(directory, backend, DeterministicFakeEmbedding(size=dim))
+    for i in range(0, chunks, 64):
+        upsert_embeddings(vector_store, documents[i:i + 64], vectors[i:i + 64].tolist())
+    if isinstance(vector_store, NumpyVectorStore):
+        vector_store.persist()
+    return time.perf_counter() - start
+
+
+def query_backend(backend: str, dim: int, queries: int, k: int, directory: str):
+    from rag.vector import open_vector_store, collection_name
+
+    query_vectors = np.random.default_rng(1).standard_normal((queries, dim), dtype=np.float32)
+
+    # 在新进程中打开已持久化的向量库再检索，与服务中加载已有向量库的情况一致
+    rss_before = rss_mib()
+    vector_store = open_vector_store(directory, collection_name, DeterministicFakeEmbedding(size=dim), backend)
+    latencies = []
+    for query_vector in query_vectors:
+        start = time.perf_counter()
+        vector_store.similarity_search_by_vector(query_vector.tolist(), k=k)
+        latencies.append(time.perf_counter() - start)
+    rss_after = rss_mib()
+
+    latencies_ms = np.array(latencies[1:]) * 1000
+    return {
+        "backend": backend,
+        "query_p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "query_p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "rss_added_mib": round(rss_after - rss_before, 1),
+        "disk_mib": round(sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names) / 1024 / 1024, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--backends", nargs="+", default=["chroma", "numpy_float32", "numpy_float16", "numpy_int8"])
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"--- {args.chunks} chunks, dim={args.dim}, k={args.k}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in args.backends:
+            directory = os.path.join(tmp_dir, backend)
+            os.mkdir(directory)
+            with context.Pool(1) as pool:
+                build_seconds = pool.apply(build_backend, (backend, args.chunks, args.dim, directory))
+            with context.Pool(1) as pool:
+                result = {**pool.apply(query_backend, (backend, args.dim, args.queries, args.k, directory)), "build_s": round(build_seconds, 3)}
+            print(
+                f"{result['backend']:<14} build={result['build_s']:7.2f}s  p50={result['query_p50_ms']:7.2f}ms  "
+                f"p99={result['query_p99_ms']:7.2f}ms  rss+={result['rss_added_mib']:6.1f} MiB  disk={result['disk_mib']:6.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,101 @@
+import os
+
 temp_file_path = r"../Temp"
 vector_cache_path = r"../vector_cache_path"
 history_docs_path = r"../history"
 frontend_file_path = r"../frontend/out"
+embedding_cache_path = r"../embedding_cache"
+
+# 上传文件的大小上限（字节）与流式写入时每次写入的块大小
+max_upload_size = 200 * 1024 * 1024
+upload_chunk_size = 1024 * 1024
+# 请求体中除文件内容外的表单边界、表头等允许的字节数，Content-Length超过max_upload_size加上这部分时直接拒绝
+upload_form_overhead = 16 * 1024
+
+# 文本分割参数
+chunk_size = 1000
+chunk_overlap = 200
+
+# 编码批次参数
+embedding_batch_size = 64
+embedding_max_workers = 4
+embedding_max_retries = 5
+embedding_retry_base_delay = 1.0
+
+# 同时运行的文档入库任务数
+ingest_max_workers = 2
+# 已结束的入库任务保留的秒数和最多保留的个数，超出后不能再查询其状态
+ingest_job_ttl = 3600
+ingest_job_max_finished = 1000
+
+# PDF多进程解析参数，页数不少于pdf_parse_parallel_min_pages时才启用
+pdf_parse_workers = os.cpu_count() or 1
+pdf_parse_pages_per_task = 32
+pdf_parse_parallel_min_pages = 200
+
+# 检索前翻译query的方式：always总是翻译，auto在问题与文档语言相同时跳过，never从不翻译
+translate_query_mode = "auto"
+translation_cache_size = 1024
+translation_cache_ttl = 7 * 24 * 3600
+# 设为None则只在内存中缓存
+translation_cache_file = os.path.join(embedding_cache_path, "translations.sqlite")
+
+# 语义答案缓存，问题向量的余弦相似度不低于阈值时直接复用之前的回答
+answer_cache_enabled = True
+answer_cache_max_entries = 1000
+answer_cache_threshold = 0.95
+
+# 会话数上限与空闲淘汰时间（秒）
+max_sessions = 256
+session_idle_ttl = 2 * 3600
+
+# LLM、编码模型客户端空闲多久后从共享池中移除（秒）
+client_idle_ttl = 30 * 60
+
+# 对话记忆策略：last_n保留最近memory_max_turns轮，token_budget按memory_token_budget截断，
+# summary保留最近memory_max_turns轮并把更早的对话滚动总结成摘要
+memory_policy = "token_budget"
+memory_max_turns = 10
+memory_token_budget = 3000
+
+# 对话记录数据库
+history_db_file = os.path.join(history_docs_path, "history.sqlite")
+
+# 默认的向量库后端：chroma、numpy_float32、numpy_float16或numpy_int8，可在设置中按会话修改
+# numpy后端检索时按块转成float32计算，int8占用最小且转换快，float16转换较慢
+vector_store_backend = "chroma"
+
+# 同时保持打开的向量库数量上限，跨文档检索时按最近使用淘汰
+max_open_vector_stores = 32
+# 跨文档检索时并发查询的线程数
+corpus_search_workers = 8
+
+# 检索参数：向量检索与BM25检索各取retrieval_candidate_k个候选，按倒数排名融合
+hybrid_search_enabled = True
+retrieval_candidate_k = 20
+rrf_k = 60
+bm25_k1 = 1.5
+bm25_b = 0.75
+
+# 重排参数：问答时取融合后的前rerank_candidate_k个候选重新打分排序，再按context_token_budgets放入提示词
+rerank_enabled = True
+rerank_candidate_k = 20
+# 跨文档检索接口默认返回的片段数
+retrieval_k = 5
+# 本地cross-encoder模型名，如"BAAI/bge-reranker-base"，需要安装sentence_transformers；为None时使用词法打分
+reranker_model = None
+# 最大边际相关性中相关度的权重，越小越偏向内容不重复
+rerank_mmr_lambda = 0.7
+
+# 日志级别，设为"DEBUG"时输出提示词、回复和每个请求各阶段的耗时
+log_level = "INFO"
+
+# 生成回复前把检索片段合并、去重后放入提示词，检索内容的token上限按LLM名设置，未列出的模型使用default
+context_token_budgets = {"default": 2000, "DeepSeek-V3": 4000, "gpt-3.5-turbo": 1500, "gpt-4": 3000}
+# 同一页相邻片段首尾重叠至少context_min_overlap个字符时合并；词集合的Jaccard相似度不低于context_dedup_threshold的片段视为重复
+context_min_overlap = 20
+context_dedup_threshold = 0.8
+
+# 批量问答：每次请求的问题数上限，以及同时进行的LLM调用数上限，请求中可以设置更小的并发数
+batch_qa_max_questions = 200
+batch_qa_concurrency = 8
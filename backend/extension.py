@@ -1,8 +1,70 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from fastapi import Depends, Header
+
 from schemas.DocQA_types import DocConfig
+from config import max_sessions, session_idle_ttl
+
+
+# 更换文档时保留的模型配置，模型客户端在会话间按引用共享
+model_config_fields = ("embedding_model_name", "embedding_model", "embedding_model_api_key", "llm_name", "llm_api_key", "llm_model", "vector_store_backend")
+
+
+class SessionRegistry:
+    """按会话id保存各自的文档配置，超出上限或长时间未使用的会话会被淘汰"""
+
+    def __init__(self, max_sessions: int, idle_ttl: float):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - last_used > self.idle_ttl:
+                del self._sessions[session_id]
+            else:
+                break
+
+    def get(self, session_id: str) -> DocConfig:
+        now = time.monotonic()
+        with self._lock:
+            if session_id in self._sessions:
+                doc_config = self._sessions.pop(session_id)[0]
+            else:
+                doc_config = DocConfig(session_id=session_id)
+            self._sessions[session_id] = (doc_config, now)
+            self._evict(now)
+        return doc_config
+
+    def reset(self, session_id: str) -> DocConfig:
+        """清空会话的文档配置，保留已配置的模型"""
+
+        old_doc_config = self.get(session_id)
+        doc_config = DocConfig(session_id=session_id, **{field: getattr(old_doc_config, field) for field in model_config_fields})
+        with self._lock:
+            self._sessions[session_id] = (doc_config, time.monotonic())
+        return doc_config
+
+    def doc_configs(self) -> List[DocConfig]:
+        with self._lock:
+            return [doc_config for doc_config, _ in self._sessions.values()]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+session_registry = SessionRegistry(max_sessions, session_idle_ttl)
+
 
-current_doc_config = DocConfig()
+def get_session_id(x_session_id: Optional[str] = Header(default=None)) -> str:
+    # 前端没有带会话id时使用默认会话
+    return x_session_id or "default"
 
 
-def InitDocConfig():
-    global current_doc_config 
-    current_doc_config = DocConfig()
+def get_current_doc_config(session_id: str = Depends(get_session_id)) -> DocConfig:
+    return session_registry.get(session_id)
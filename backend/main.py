@@ -1,12 +1,17 @@
 import os
+import logging
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from api import chat, upload, embedding, setting
+from api import chat, upload, embedding, setting, history, corpus, metrics, batch
+from rag.vector import remove_superseded_indexes
 from config import *
 
 
+logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
 # 创建路径
 if not os.path.exists(temp_file_path):
     os.mkdir(temp_file_path)
@@ -14,6 +19,11 @@ if not os.path.exists(vector_cache_path):
     os.mkdir(vector_cache_path)
 if not os.path.exists(history_docs_path):
     os.mkdir(history_docs_path)
+if not os.path.exists(embedding_cache_path):
+    os.mkdir(embedding_cache_path)
+
+# 启动时还没有会话，上次运行留下的已被取代的旧版本向量库都可以删除
+remove_superseded_indexes([])
 
 
 app = FastAPI()
@@ -37,3 +47,7 @@ app.include_router(chat.router, prefix="/api")
 app.include_router(upload.router, prefix="/api")
 app.include_router(embedding.router, prefix="/api")
 app.include_router(setting.router, prefix="/api")
+app.include_router(history.router, prefix="/api")
+app.include_router(corpus.router, prefix="/api")
+app.include_router(metrics.router, prefix="/api")
+app.include_router(batch.router, prefix="/api")
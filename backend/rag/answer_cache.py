@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import answer_cache_max_entries, answer_cache_threshold
+
+
+class SemanticAnswerCache:
+    """按(文档hash, 编码模型名, LLM名)分组的语义答案缓存，问题向量足够相似时直接返回之前的回答"""
+
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        # 全局按最近使用排序，超出上限时淘汰最久未用的
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._groups: Dict[Tuple[str, str, str], Dict[int, Dict[str, Any]]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
+
+    def lookup(self, doc_hash: str, embedding_model_name: str, llm_name: str, question_vector: List[float]) -> Optional[Dict[str, Any]]:
+        query = self._normalize(question_vector)
+
+        with self._lock:
+            self.lookups += 1
+            # 不同编码模型的向量维度、空间都不同，不能放在一起比较
+            group = self._groups.get((doc_hash, embedding_model_name, llm_name))
+            if not group:
+                return None
+
+            entry_ids = list(group.keys())
+            similarities = np.stack([group[i]["vector"] for i in entry_ids]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            self.hits += 1
+            entry_id = entry_ids[best]
+            self._entries.move_to_end(entry_id)
+            entry = group[entry_id]
+            return {
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "sources": entry["sources"],
+                "similarity": float(similarities[best])
+            }
+
+    def add(self, doc_hash: str, embedding_model_name: str, llm_name: str, question: str, question_vector: List[float], answer: str, sources: List[Dict[str, Any]]):
+        entry = {
+            "key": (doc_hash, embedding_model_name, llm_name),
+            "question": question,
+            "vector": self._normalize(question_vector),
+            "answer": answer,
+            "sources": sources
+        }
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._groups.setdefault(entry["key"], {})[entry_id] = entry
+
+            while len(self._entries) > self.max_entries:
+                old_id, old_entry = self._entries.popitem(last=False)
+                group = self._groups[old_entry["key"]]
+                del group[old_id]
+                if not group:
+                    del self._groups[old_entry["key"]]
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+
+answer_cache = SemanticAnswerCache(answer_cache_max_entries, answer_cache_threshold)
@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
+
+from rag.context import document_source, context_token_budget, used_sources
+from rag.metrics import span, record_token_usage
+from rag.models import translate_query_for_retrieval, build_system_prompt, build_context_prompt, pack_sources
+from rag.retrieval import retrieve_documents_batch
+from schemas.DocQA_types import DocConfig
+
+
+async def answer_question(doc_config: DocConfig, index: int, question: str, docs: List[Document]) -> Dict[str, Any]:
+    """单个问题只用检索到的内容作答，不带对话记录"""
+
+    # 与retrieve_node一致，只返回实际放入提示词的片段
+    sources = [document_source(doc) for doc in docs]
+    sources = [sources[i] for i in used_sources(sources, context_token_budget(doc_config.llm_name), doc_config.corpus_documents is not None)]
+    prompt = [build_system_prompt(doc_config), build_context_prompt(pack_sources(doc_config, sources)), HumanMessage(content=question)]
+
+    try:
+        with span("batch_generate") as record:
+            response = await doc_config.llm_model.ainvoke(prompt)
+            usage = record_token_usage("batch_generate", response)
+            record.set(**usage)
+    except Exception as e:
+        return {"index": index, "question": question, "error": f"模型响应失败！\n{e}"}
+
+    return {"index": index, "question": question, "answer": response.content, "sources": sources, "usage": usage}
+
+
+async def batch_answer(doc_config: DocConfig, questions: Sequence[str], concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+    """批量问答，按完成顺序逐个返回结果，不写入对话记录和语义缓存
+
+    翻译和生成都调用LLM，同时进行的调用数不超过concurrency；检索时所有问题一次编码、一起查询。
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def translate(question: str) -> str:
+        async with semaphore:
+            return await translate_query_for_retrieval(doc_config, question)
+
+    translate_queries = await asyncio.gather(*(translate(question) for question in questions))
+    # 与retrieve_node一致，BM25检索同时使用原问题和翻译的关键词
+    lexical_queries = [question if translate_query == question else f"{question}\n{translate_query}" for question, translate_query in zip(questions, translate_queries)]
+    retrieved = await retrieve_documents_batch(doc_config, translate_queries, lexical_queries)
+
+    async def answer(index: int) -> Dict[str, Any]:
+        async with semaphore:
+            return await answer_question(doc_config, index, questions[index], retrieved[index])
+
+    tasks = [asyncio.ensure_future(answer(index)) for index in range(len(questions))]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # 客户端中途断开时取消还没完成的生成
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,50 @@
+import time
+import hashlib
+import threading
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from pydantic import SecretStr
+
+from config import client_idle_ttl
+
+
+def hash_api_key(api_key: Optional[SecretStr]) -> str:
+    # 只保存API Key的hash，不在内存中留明文副本
+    if api_key is None:
+        return ""
+    return hashlib.sha256(api_key.get_secret_value().encode("utf-8")).hexdigest()
+
+
+class ClientPool:
+    """进程内共用的LLM和编码模型客户端，相同模型和API Key只创建一个实例，复用其HTTP连接池"""
+
+    def __init__(self, idle_ttl: float):
+        self.idle_ttl = idle_ttl
+        self._clients: Dict[Tuple[str, str, str], Tuple[Any, float]] = {}
+        # 被淘汰但仍有会话在用的客户端，下次获取时继续复用
+        self._in_use: "weakref.WeakValueDictionary[Tuple[str, str, str], Any]" = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def _evict_idle(self, now: float):
+        for key in [key for key, (_, last_used) in self._clients.items() if now - last_used > self.idle_ttl]:
+            del self._clients[key]
+
+    def get_or_create(self, kind: str, model_name: str, api_key: Optional[SecretStr], factory: Callable[[], Any]) -> Any:
+        key = (kind, model_name, hash_api_key(api_key))
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_idle(now)
+            client = self._clients[key][0] if key in self._clients else self._in_use.get(key)
+            if client is None:
+                client = factory()
+                self._in_use[key] = client
+            self._clients[key] = (client, now)
+            return client
+
+    def __len__(self):
+        return len(self._clients)
+
+
+client_pool = ClientPool(client_idle_ttl)
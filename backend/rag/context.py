@@ -0,0 +1,137 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages.utils import count_tokens_approximately
+
+from rag.lexical import tokenize
+from rag.rerank import jaccard
+from config import context_token_budgets, context_min_overlap, context_dedup_threshold
+
+
+def document_source(doc: Document) -> Dict[str, Any]:
+    # 检索片段的来源页码，供前端展示引用，也是合并片段的依据
+    return {"page": doc.metadata.get("page"), "page_label": doc.metadata.get("page_label"), "content": doc.page_content, "file_name": doc.metadata.get("file_name")}
+
+
+def context_token_budget(llm_name: Optional[str]) -> int:
+    return context_token_budgets.get(llm_name or "", context_token_budgets["default"])
+
+
+def overlap_length(left: str, right: str, min_overlap: int = context_min_overlap) -> int:
+    """left结尾与right开头重合的字符数，不足min_overlap时返回0"""
+
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    # 重合部分一定以right的前min_overlap个字符开头，只检查这些位置
+    head = right[:min_overlap]
+    start = left.find(head, max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(head, start + 1)
+    return 0
+
+
+def merge_block(block: Dict[str, Any], source: Dict[str, Any]) -> bool:
+    """把同一页的片段并入block，重合或包含时返回True"""
+
+    if (block.get("file_name"), block.get("page")) != (source.get("file_name"), source.get("page")):
+        return False
+
+    content, new_content = block["content"], source["content"]
+    if new_content in content:
+        return True
+    if content in new_content:
+        block["content"] = new_content
+        return True
+    # 分割时相邻片段有chunk_overlap的重叠，先后两种顺序都要检查
+    length = overlap_length(content, new_content)
+    if length:
+        block["content"] = content + new_content[length:]
+        return True
+    length = overlap_length(new_content, content)
+    if length:
+        block["content"] = new_content + content[length:]
+        return True
+    return False
+
+
+# 合并后的一段内容，以及并入其中的片段在sources中的序号
+Block = Tuple[Dict[str, Any], List[int]]
+
+
+def merge_sources(sources: Sequence[Dict[str, Any]]) -> List[Block]:
+    # 按检索名次依次合并，合并后的片段排在其中名次最靠前的片段的位置
+    blocks: List[Block] = []
+    for i, source in enumerate(sources):
+        for block, members in blocks:
+            if merge_block(block, source):
+                members.append(i)
+                break
+        else:
+            blocks.append((dict(source), [i]))
+
+    # 中间的片段排名靠后时，前后两段要等它并入后才能连起来
+    merged = True
+    while merged and len(blocks) > 1:
+        merged = False
+        for i in range(len(blocks)):
+            for j in range(i + 1, len(blocks)):
+                if merge_block(blocks[i][0], blocks[j][0]):
+                    blocks[i][1].extend(blocks[j][1])
+                    del blocks[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return blocks
+
+
+def drop_near_duplicates(blocks: Sequence[Block], threshold: float = context_dedup_threshold) -> List[Block]:
+    # 不同页重复的页眉、模板段落等内容只保留名次最靠前的一份
+    kept: List[Block] = []
+    kept_tokens: List[set] = []
+    for block, members in blocks:
+        tokens = set(tokenize(block["content"]))
+        if any(jaccard(tokens, other) >= threshold for other in kept_tokens):
+            continue
+        kept.append((block, members))
+        kept_tokens.append(tokens)
+    return kept
+
+
+def format_block(block: Dict[str, Any], with_file_name: bool) -> str:
+    # 保留页码，回答时可以注明出处
+    page = block.get("page")
+    citation = f"第{page + 1}页" if isinstance(page, int) else ""
+    if with_file_name:
+        citation = f"《{block.get('file_name')}》{citation}"
+    return f"{citation}：{block['content']}" if citation else block["content"]
+
+
+def select_blocks(sources: Sequence[Dict[str, Any]], token_budget: int, with_file_name: bool = False) -> List[Tuple[str, List[int]]]:
+    """把检索片段合并、去重，按名次放入token预算，返回带页码的各段内容和其中的片段序号"""
+
+    packed: List[Tuple[str, List[int]]] = []
+    used_tokens = 0
+    for block, members in drop_near_duplicates(merge_sources(sources)):
+        text = format_block(block, with_file_name)
+        tokens = count_tokens_approximately([text])
+        if used_tokens + tokens > token_budget:
+            if not packed:
+                # 第一段就超出预算时按比例截断，保证提示词长度有上限
+                packed.append((text[:len(text) * token_budget // tokens], members))
+            break
+        packed.append((text, members))
+        used_tokens += tokens
+    return packed
+
+
+def pack_context(sources: Sequence[Dict[str, Any]], token_budget: int, with_file_name: bool = False) -> List[str]:
+    return [text for text, _ in select_blocks(sources, token_budget, with_file_name)]
+
+
+def used_sources(sources: Sequence[Dict[str, Any]], token_budget: int, with_file_name: bool = False) -> List[int]:
+    """放入token预算的片段在sources中的序号，按检索名次排列；只用这些片段打包的结果与用全部片段打包相同"""
+
+    return sorted(i for _, members in select_blocks(sources, token_budget, with_file_name) for i in members)
@@ -0,0 +1,152 @@
+import os
+import heapq
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Any, Collection, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from rag.lexical import reciprocal_rank_fusion
+from rag.numpy_store import NumpyVectorStore
+from rag.vector import read_manifest, open_vector_store, open_lexical_index
+from config import vector_cache_path, corpus_search_workers, retrieval_candidate_k, rrf_k
+
+
+# 各文档的检索在线程池中并发进行；每个文档都要查询一次，文档数超过corpus_search_workers后总延迟随文档数增长
+corpus_executor = ThreadPoolExecutor(max_workers=corpus_search_workers, thread_name_prefix="corpus")
+
+
+def list_corpus_documents(embedding_model_name: Optional[str] = None, file_hashes: Optional[Collection[str]] = None) -> List[Dict[str, Any]]:
+    """列出已构建好向量库的文档，指定编码模型时只返回用该模型编码的文档，指定file_hashes时只返回其中的文档"""
+
+    documents = []
+    doc_ids = set()
+    if not os.path.exists(vector_cache_path):
+        return documents
+
+    for name in sorted(os.listdir(vector_cache_path)):
+        vector_cache_path_ = os.path.join(vector_cache_path, name)
+        manifest = read_manifest(vector_cache_path_)
+        # 已被同名文档新版本取代的旧版本不再参与检索
+        if manifest is None or manifest.get("superseded_by"):
+            continue
+        if embedding_model_name is not None and manifest.get("embedding_model_name") != embedding_model_name:
+            continue
+        if file_hashes is not None and manifest["file_hash"] not in file_hashes:
+            continue
+        # 同一文档可能用不同后端各建了一份向量库，只列出一份
+        if manifest["file_hash"] in doc_ids:
+            continue
+        doc_ids.add(manifest["file_hash"])
+        documents.append({
+            "doc_id": manifest["file_hash"],
+            "file_name": manifest.get("file_name") or name,
+            "embedding_model_name": manifest.get("embedding_model_name"),
+            "vector_store_backend": manifest.get("vector_store_backend", "chroma"),
+            "collection_name": manifest["collection_name"],
+            "chunk_count": manifest.get("chunk_count"),
+            "vector_cache_path": vector_cache_path_
+        })
+    return documents
+
+
+def search_by_vector_with_scores(vector_store: VectorStore, query_vector: List[float], k: int) -> List[Tuple[Document, float]]:
+    # 不同文档、不同后端的结果要放在一起比较，统一用余弦相似度
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.similarity_search_with_score_by_vector(query_vector, k)
+
+    # 之前版本建的Chroma collection按L2距离检索，由距离换算的相关度与余弦不可比，取出向量重新计算余弦
+    results = vector_store._collection.query(query_embeddings=[query_vector], n_results=k, include=["documents", "metadatas", "embeddings"])  # type: ignore[attr-defined]
+    if not results["ids"][0]:
+        return []
+    vectors = np.asarray(results["embeddings"][0], dtype=np.float32)  # type: ignore[index]
+    query = np.asarray(query_vector, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = 1
+    scores = vectors @ query / norms
+    hits = [
+        (Document(page_content=document or "", metadata=metadata or {}, id=doc_id), float(score))
+        for doc_id, document, metadata, score in zip(results["ids"][0], results["documents"][0], results["metadatas"][0], scores)  # type: ignore[index]
+    ]
+    return sorted(hits, key=lambda hit: hit[1], reverse=True)
+
+
+def search_document(document: Dict[str, Any], embeddings: Embeddings, query_vector: List[float], lexical_query: Optional[str], k: int):
+    """在单个文档中检索，返回带来源的向量检索结果，以及BM25检索到的片段id和分数"""
+
+    vector_store = open_vector_store(document["vector_cache_path"], document["collection_name"], embeddings, document["vector_store_backend"])
+    vector_hits = [(with_source(doc, document), score) for doc, score in search_by_vector_with_scores(vector_store, query_vector, k)]
+
+    lexical_hits = []
+    if lexical_query is not None:
+        lexical_hits = open_lexical_index(document["vector_cache_path"], vector_store).search(lexical_query, k)
+
+    return vector_hits, lexical_hits
+
+
+def with_source(doc: Document, document: Dict[str, Any]) -> Document:
+    doc.metadata = {**doc.metadata, "doc_id": document["doc_id"], "file_name": document["file_name"]}
+    return doc
+
+
+def fetch_documents(document: Dict[str, Any], embeddings: Embeddings, chunk_ids: List[str]) -> List[Document]:
+    vector_store = open_vector_store(document["vector_cache_path"], document["collection_name"], embeddings, document["vector_store_backend"])
+    return [with_source(doc, document) for doc in vector_store.get_by_ids(chunk_ids)]
+
+
+async def corpus_search(documents: Sequence[Dict[str, Any]], embeddings: Embeddings, vector_query: str, lexical_query: Optional[str], k: int, query_vector: Optional[List[float]] = None) -> List[Document]:
+    """在多个文档中检索，问题只编码一次，各文档并发查询后合并前k个结果；已编码过的问题可直接传入query_vector"""
+
+    if not documents:
+        return []
+
+    if query_vector is None:
+        query_vector = await embeddings.aembed_query(vector_query)
+    per_document_k = max(k, retrieval_candidate_k) if lexical_query is not None else k
+
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(corpus_executor, search_document, document, embeddings, query_vector, lexical_query, per_document_k)
+        for document in documents
+    ))
+
+    # 每个文档只取前k个，合并后的候选数与文档数无关
+    vector_hits = heapq.nlargest(per_document_k, chain.from_iterable(vector for vector, _ in results), key=lambda hit: hit[1])
+    if lexical_query is None:
+        return [doc for doc, _ in vector_hits[:k]]
+
+    # 各文档的BM25分数按各自的词频统计，不完全可比，只用来排出名次再融合
+    lexical_hits = heapq.nlargest(
+        per_document_k,
+        ((i, chunk_id, score) for i, (_, lexical) in enumerate(results) for chunk_id, score in lexical),
+        key=lambda hit: hit[2]
+    )
+    fused = reciprocal_rank_fusion([
+        [corpus_key(doc.metadata["doc_id"], doc.id) for doc, _ in vector_hits],
+        [corpus_key(documents[i]["doc_id"], chunk_id) for i, chunk_id, _ in lexical_hits]
+    ], rrf_k)[:k]
+
+    # 只被BM25检索到的片段最后再按文档分组取出内容
+    docs_by_key = {corpus_key(doc.metadata["doc_id"], doc.id): doc for doc, _ in vector_hits}
+    fused_keys = {key for key, _ in fused}
+    missing: Dict[int, List[str]] = {}
+    for i, chunk_id, _ in lexical_hits:
+        key = corpus_key(documents[i]["doc_id"], chunk_id)
+        if key in fused_keys and key not in docs_by_key:
+            missing.setdefault(i, []).append(chunk_id)
+    fetched = await asyncio.gather(*(
+        loop.run_in_executor(corpus_executor, fetch_documents, documents[i], embeddings, chunk_ids)
+        for i, chunk_ids in missing.items()
+    ))
+    for doc in chain.from_iterable(fetched):
+        docs_by_key[corpus_key(doc.metadata["doc_id"], doc.id)] = doc
+
+    return [docs_by_key[key] for key, _ in fused if key in docs_by_key]
+
+
+def corpus_key(doc_id: str, chunk_id: Optional[str]) -> str:
+    return f"{doc_id}:{chunk_id}"
@@ -0,0 +1,72 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from rag.metrics import record_cache_event
+
+
+class CachedEmbeddings(Embeddings):
+    """带持久化缓存的编码模型，只有缓存中没有的文本才会交给真正的编码模型"""
+
+    def __init__(self, underlying: Embeddings, namespace: str, cache_db_path: str):
+        self.underlying = underlying
+        # namespace由编码模型名和分割参数组成，不同配置的向量不会混用
+        self.namespace = namespace
+        self.cache_db_path = cache_db_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        with sqlite3.connect(self.cache_db_path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> List[Optional[List[float]]]:
+        vectors = {}
+        with sqlite3.connect(self.cache_db_path) as conn:
+            # sqlite单条语句的参数个数有限制，分批查询
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    vectors[key] = array("d", blob).tolist()
+        return [vectors.get(key) for key in keys]
+
+    def _store(self, keys: List[str], vectors: List[List[float]]):
+        with sqlite3.connect(self.cache_db_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("d", vector).tobytes()) for key, vector in zip(keys, vectors)]
+            )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self._lookup(keys)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            new_vectors = self.underlying.embed_documents([texts[i] for i in missing])
+            self._store([keys[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        record_cache_event("embedding", True, len(texts) - len(missing))
+        record_cache_event("embedding", False, len(missing))
+
+        return vectors  # type: ignore[return-value]
+
+    def embed_query(self, text: str) -> List[float]:
+        # 查询语句每次都不同，不做缓存
+        return self.underlying.embed_query(text)
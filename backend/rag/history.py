@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, messages_from_dict, message_to_dict
+
+from schemas.DocQA_types import DocConfig
+from config import history_db_file
+
+
+class ChatHistoryStore:
+    """对话记录的sqlite存储，每轮只追加新消息、删除被裁剪的消息"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._table_ready:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with sqlite3.connect(self.db_path) as conn:
+                conn.executescript(
+                    """
+                    CREATE TABLE IF NOT EXISTS documents (
+                        thread_id TEXT PRIMARY KEY,
+                        session_id TEXT,
+                        file_name TEXT,
+                        file_hash TEXT,
+                        tmp_file_path TEXT,
+                        lanuage TEXT,
+                        embedding_model_name TEXT,
+                        llm_name TEXT,
+                        vector_cache_path TEXT,
+                        summary TEXT NOT NULL DEFAULT '',
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    );
+                    CREATE TABLE IF NOT EXISTS messages (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        thread_id TEXT NOT NULL,
+                        message_id TEXT NOT NULL,
+                        data TEXT NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS messages_thread ON messages (thread_id, seq);
+                    CREATE INDEX IF NOT EXISTS messages_id ON messages (thread_id, message_id);
+                    CREATE INDEX IF NOT EXISTS documents_session ON documents (session_id, updated_at);
+                    """
+                )
+            self._table_ready = True
+        return sqlite3.connect(self.db_path)
+
+    def save_turn(self, doc_config: DocConfig, appended: Sequence[BaseMessage], removed_ids: Sequence[str]):
+        assert doc_config.thread_id is not None
+        now = time.time()
+
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO documents (thread_id, session_id, file_name, file_hash, tmp_file_path, lanuage, embedding_model_name, llm_name, vector_cache_path, summary, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(thread_id) DO UPDATE SET
+                    file_name = excluded.file_name, file_hash = excluded.file_hash, tmp_file_path = excluded.tmp_file_path,
+                    lanuage = excluded.lanuage, embedding_model_name = excluded.embedding_model_name, llm_name = excluded.llm_name,
+                    vector_cache_path = excluded.vector_cache_path, summary = excluded.summary, updated_at = excluded.updated_at
+                """,
+                (
+                    doc_config.thread_id, doc_config.session_id, doc_config.file_name, doc_config.file_hash, doc_config.tmp_file_path,
+                    doc_config.lanuage, doc_config.embedding_model_name, doc_config.llm_name, doc_config.vector_cache_path,
+                    doc_config.chat_summary, now, now
+                )
+            )
+            conn.executemany(
+                "INSERT INTO messages (thread_id, message_id, data) VALUES (?, ?, ?)",
+                [(doc_config.thread_id, message.id, json.dumps(message_to_dict(message), ensure_ascii=False, default=str)) for message in appended]
+            )
+            conn.executemany(
+                "DELETE FROM messages WHERE thread_id = ? AND message_id = ?",
+                [(doc_config.thread_id, message_id) for message_id in removed_ids]
+            )
+
+    def load_messages(self, thread_id: str) -> List[BaseMessage]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT data FROM messages WHERE thread_id = ? ORDER BY seq", (thread_id,)).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    def get_document(self, thread_id: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """指定session_id时，其他会话的记录视为不存在"""
+
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM documents WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None or (session_id is not None and row["session_id"] != session_id):
+            return None
+        return dict(row)
+
+    def list_documents(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                """
+                SELECT d.thread_id, d.file_name, d.file_hash, d.lanuage, d.llm_name, d.created_at, d.updated_at,
+                       (SELECT COUNT(*) FROM messages m WHERE m.thread_id = d.thread_id) AS message_count
+                FROM documents d WHERE d.session_id = ? ORDER BY d.updated_at DESC
+                """,
+                (session_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+history_store = ChatHistoryStore(history_db_file)
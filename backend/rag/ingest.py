@@ -0,0 +1,173 @@
+import time
+import logging
+import uuid
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from rag.metrics import trace_request
+from rag.vector import load_and_index_pdf, load_existing_index, compute_file_hash, remove_superseded_indexes
+from schemas.DocQA_types import DocConfig, IngestJob
+from extension import session_registry
+from config import ingest_max_workers, ingest_job_ttl, ingest_job_max_finished
+
+logger = logging.getLogger(__name__)
+
+
+# 入库任务在独立的线程池中执行，不阻塞事件循环
+ingest_executor = ThreadPoolExecutor(max_workers=ingest_max_workers, thread_name_prefix="ingest")
+ingest_jobs: Dict[str, IngestJob] = {}
+# 未结束的任务按(会话, 文件)索引，已结束的任务按结束顺序排列，便于按时间淘汰
+active_ingest_jobs: Dict[Tuple[Optional[str], str], str] = {}
+finished_ingest_jobs: "OrderedDict[str, float]" = OrderedDict()
+ingest_jobs_lock = threading.Lock()
+# 同一份向量库同时只允许一个任务打开或构建，其他会话的任务等待后直接复用构建结果
+index_locks: Dict[Tuple[str, Optional[str], str], Tuple[threading.Lock, int]] = {}
+index_locks_lock = threading.Lock()
+
+
+@contextmanager
+def index_lock(file_hash: str, embedding_model_name: Optional[str], backend: str):
+    key = (file_hash, embedding_model_name, backend)
+    with index_locks_lock:
+        lock, waiters = index_locks.get(key, (threading.Lock(), 0))
+        index_locks[key] = (lock, waiters+1)
+
+    try:
+        with lock:
+            yield
+    finally:
+        # 没有任务再使用时删除锁，避免字典无限增长
+        with index_locks_lock:
+            lock, waiters = index_locks[key]
+            if waiters == 1:
+                del index_locks[key]
+            else:
+                index_locks[key] = (lock, waiters-1)
+
+
+def prune_ingest_jobs(now: float):
+    # 调用方需持有ingest_jobs_lock
+    while finished_ingest_jobs:
+        job_id, finished_at = next(iter(finished_ingest_jobs.items()))
+        if now - finished_at < ingest_job_ttl and len(finished_ingest_jobs) <= ingest_job_max_finished:
+            break
+        finished_ingest_jobs.popitem(last=False)
+        ingest_jobs.pop(job_id, None)
+
+
+def finish_ingest_job(job: IngestJob):
+    with ingest_jobs_lock:
+        job.finished_at = time.time()
+        key = (job.session_id, job.file_path)
+        if active_ingest_jobs.get(key) == job.job_id:
+            del active_ingest_jobs[key]
+        finished_ingest_jobs[job.job_id] = job.finished_at
+        prune_ingest_jobs(job.finished_at)
+
+
+def index_paths_in_use() -> List[str]:
+    # 各会话当前文档和跨文档检索选中的文档所用的向量库
+    paths = []
+    for doc_config in session_registry.doc_configs():
+        if doc_config.vector_cache_path is not None:
+            paths.append(doc_config.vector_cache_path)
+        paths.extend(document["vector_cache_path"] for document in doc_config.corpus_documents or [])
+    return paths
+
+
+def run_ingest_job(job: IngestJob, doc_config: DocConfig):
+    try:
+        execute_ingest_job(job, doc_config)
+    finally:
+        finish_ingest_job(job)
+
+    # 新版本入库后，删除没有会话再使用的旧版本
+    if job.status == "succeeded":
+        try:
+            remove_superseded_indexes(index_paths_in_use())
+        except Exception as e:
+            logger.warning("删除旧版本向量库失败：%s", e)
+
+
+def execute_ingest_job(job: IngestJob, doc_config: DocConfig):
+    if job.cancel_requested:
+        job.status = "cancelled"
+        job.message = "已取消构建向量库。"
+        return
+
+    job.status = "running"
+
+    try:
+        # 已有参数一致的向量库时直接打开，否则重新构建
+        with trace_request("ingest"):
+            file_hash = job.file_hash or compute_file_hash(job.file_path)
+            with index_lock(file_hash, doc_config.embedding_model_name, doc_config.vector_store_backend):
+                index_result = load_existing_index(job.file_path, file_hash, doc_config.embedding_model, doc_config.embedding_model_name, doc_config.vector_store_backend)
+                if not index_result.state:
+                    index_result = load_and_index_pdf(job.file_path, doc_config.embedding_model, doc_config.embedding_model_name, file_hash, job, doc_config.vector_store_backend)
+    except Exception as e:
+        job.status = "failed"
+        job.message = f"构建向量库失败！\n{e}"
+        return
+
+    if not index_result.state or index_result.addition_args is None:
+        job.status = "cancelled" if job.cancel_requested else "failed"
+        job.message = index_result.source+": "+index_result.message
+        return
+
+    # 构建期间用户可能已经换了文档，只有文档没变时才更新配置
+    if doc_config.tmp_file_path == job.file_path:
+        doc_config.vector_store = index_result.addition_args["vector_store"]
+        doc_config.lexical_index = index_result.addition_args["lexical_index"]
+        doc_config.vector_cache_path = index_result.addition_args["vector_store_cache_path"]
+        doc_config.file_hash = index_result.addition_args["file_hash"]
+        # 向量库变了，graph需要重新构建
+        doc_config.graph = None
+
+    job.addition_args = {
+        "vector_store_cache_path": index_result.addition_args["vector_store_cache_path"],
+        "reused": index_result.addition_args["reused"],
+        "incremental": index_result.addition_args.get("incremental", False),
+        "chunks_added": index_result.addition_args.get("chunks_added", 0),
+        "chunks_deleted": index_result.addition_args.get("chunks_deleted", 0),
+        "cache_hits": index_result.addition_args["cache_hits"],
+        "cache_misses": index_result.addition_args["cache_misses"]
+    }
+    job.status = "succeeded"
+    job.message = index_result.source+": "+index_result.message
+
+
+def submit_ingest_job(doc_config: DocConfig) -> IngestJob:
+    assert doc_config.tmp_file_path is not None
+
+    key = (doc_config.session_id, doc_config.tmp_file_path)
+    with ingest_jobs_lock:
+        prune_ingest_jobs(time.time())
+
+        # 同一会话同一文件已有未结束的任务时直接返回该任务
+        active_job_id = active_ingest_jobs.get(key)
+        if active_job_id is not None:
+            return ingest_jobs[active_job_id]
+
+        job = IngestJob(job_id=uuid.uuid4().hex, session_id=doc_config.session_id, file_path=doc_config.tmp_file_path, file_hash=doc_config.file_hash)
+        ingest_jobs[job.job_id] = job
+        active_ingest_jobs[key] = job.job_id
+
+    ingest_executor.submit(run_ingest_job, job, doc_config)
+    return job
+
+
+def get_ingest_job(job_id: str) -> Optional[IngestJob]:
+    with ingest_jobs_lock:
+        return ingest_jobs.get(job_id)
+
+
+def cancel_ingest_job(job_id: str) -> Optional[IngestJob]:
+    with ingest_jobs_lock:
+        job = ingest_jobs.get(job_id)
+    if job is not None and job.status in ("pending", "running"):
+        job.cancel_requested = True
+    return job
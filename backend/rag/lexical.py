@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import math
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config import bm25_k1, bm25_b
+
+
+lexical_index_file_name = "lexical_index.json"
+lexical_postings_file_name = "lexical_index.npz"
+
+# 英文按词切分，保留3.2.1、BM25、k-means这类编号和术语；中文连续汉字切成单字和二元组
+token_pattern = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*|[\u4e00-\u9fff]+")
+token_part_pattern = re.compile(r"[._\-]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in token_pattern.findall(text.lower()):
+        if "\u4e00" <= token[0] <= "\u9fff":
+            tokens.extend(token)
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token)
+            # 带连接符的词同时按各部分索引，k-means也能被means检索到
+            parts = token_part_pattern.split(token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class LexicalIndex:
+    """BM25倒排索引，只保存片段id和词频，片段内容仍从向量库中取"""
+
+    def __init__(self, ids: List[str], terms: List[str], offsets: np.ndarray, postings_docs: np.ndarray, postings_tfs: np.ndarray, doc_lens: np.ndarray):
+        self.ids = ids
+        self.terms = terms
+        self.term_index = {term: i for i, term in enumerate(terms)}
+        # 第i个词的倒排表是postings_docs[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+        self.postings_docs = postings_docs
+        self.postings_tfs = postings_tfs
+        self.doc_lens = doc_lens
+        self.avg_doc_len = float(doc_lens.mean()) if len(doc_lens) else 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        if not self.ids:
+            return []
+
+        doc_count = len(self.ids)
+        scores = np.zeros(doc_count, dtype=np.float32)
+        length_norm = bm25_k1 * (1 - bm25_b + bm25_b * self.doc_lens / max(self.avg_doc_len, 1.0))
+
+        for term in set(tokenize(query)):
+            i = self.term_index.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            docs = self.postings_docs[start:end]
+            tfs = self.postings_tfs[start:end]
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            # 同一个词的倒排表中片段不重复，可以直接按下标累加
+            scores[docs] += idf * tfs * (bm25_k1 + 1) / (tfs + length_norm[docs])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+
+        return [(self.ids[i], float(scores[i])) for i in matched]
+
+    def save(self, directory: str):
+        # 先写临时文件再替换，与向量库清单的写法一致
+        postings_path = os.path.join(directory, lexical_postings_file_name)
+        with open(postings_path + ".tmp", "wb") as f:
+            np.savez(f, offsets=self.offsets, postings_docs=self.postings_docs, postings_tfs=self.postings_tfs, doc_lens=self.doc_lens)
+        os.replace(postings_path + ".tmp", postings_path)
+
+        index_path = os.path.join(directory, lexical_index_file_name)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "terms": self.terms}, f, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["LexicalIndex"]:
+        index_path = os.path.join(directory, lexical_index_file_name)
+        postings_path = os.path.join(directory, lexical_postings_file_name)
+        if not os.path.exists(index_path) or not os.path.exists(postings_path):
+            return None
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with np.load(postings_path) as postings:
+                return cls(data["ids"], data["terms"], postings["offsets"], postings["postings_docs"], postings["postings_tfs"], postings["doc_lens"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+class LexicalIndexBuilder:
+    """入库时逐批加入片段，全部加入后build得到只读的LexicalIndex"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.doc_lens = array("I")
+        self._postings: Dict[str, Tuple[array, array]] = {}
+
+    def add_documents(self, documents: Iterable[Document]):
+        for doc in documents:
+            assert doc.id is not None
+            doc_index = len(self.ids)
+            self.ids.append(doc.id)
+            counts = Counter(tokenize(doc.page_content))
+            self.doc_lens.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("I"), array("H"))
+                postings[0].append(doc_index)
+                postings[1].append(min(tf, 65535))
+
+    def build(self) -> LexicalIndex:
+        terms = list(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self._postings[term][0]) for term in terms])
+        postings_docs = np.empty(offsets[-1], dtype=np.uint32)
+        postings_tfs = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            docs, tfs = self._postings[term]
+            postings_docs[offsets[i]:offsets[i + 1]] = docs
+            postings_tfs[offsets[i]:offsets[i + 1]] = tfs
+
+        return LexicalIndex(self.ids, terms, offsets, postings_docs, postings_tfs, np.asarray(self.doc_lens, dtype=np.float32))
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int) -> List[Tuple[str, float]]:
+    """按倒数排名融合多路检索结果，各路的分数尺度不同，只看名次"""
+
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,87 @@
+from typing import List, Sequence
+
+from langchain_core.messages import BaseMessage, RemoveMessage, SystemMessage, HumanMessage
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+from langgraph.graph import MessagesState
+
+from config import memory_policy, memory_max_turns, memory_token_budget
+
+
+class RagState(MessagesState):
+    # summary策略下早期对话的滚动摘要
+    summary: str
+
+
+def split_turns(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    """按HumanMessage把对话切分成轮"""
+
+    turns: List[List[BaseMessage]] = []
+    for message in messages:
+        if message.type == "human" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def select_history(state: RagState) -> List[BaseMessage]:
+    """按记忆策略挑选放进提示词的对话，不含检索结果"""
+
+    conversation_messages = [
+        message for message in state["messages"]
+        if message.type in ("human", "system") or (message.type == "ai" and not message.tool_calls)  # type: ignore[attr-defined]
+    ]
+
+    if memory_policy == "token_budget":
+        # 当前的问题一定保留，只截断之前的对话，问题本身超出预算时不带之前的对话
+        current_start = max((i for i, message in enumerate(conversation_messages) if message.type == "human"), default=len(conversation_messages))
+        current = conversation_messages[current_start:]
+        history_budget = memory_token_budget - count_tokens_approximately(current)
+        if history_budget <= 0:
+            return current
+        return trim_messages(
+            conversation_messages[:current_start],
+            max_tokens=history_budget,
+            strategy="last",
+            token_counter=count_tokens_approximately,
+            start_on="human",
+            include_system=False
+        ) + current
+
+    # last_n和summary都只保留最近几轮，summary额外带上早期对话的摘要
+    history = [message for turn in split_turns(conversation_messages)[-memory_max_turns:] for message in turn]
+    if memory_policy == "summary" and state.get("summary"):
+        history = [SystemMessage(f"之前对话的摘要：\n{state['summary']}")] + history
+    return history
+
+
+def prune_tool_messages(messages: Sequence[BaseMessage]) -> List[RemoveMessage]:
+    """删除之前各轮的检索结果，只保留最后一轮的ToolMessage"""
+
+    trailing_ids = set()
+    for message in reversed(messages):
+        if message.type == "human":
+            break
+        trailing_ids.add(message.id)
+
+    return [RemoveMessage(id=message.id) for message in messages if message.type == "tool" and message.id not in trailing_ids and message.id is not None]
+
+
+def turns_to_summarize(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    # 超过两倍窗口时才把窗口之外的轮次折叠进摘要，摘要调用的开销被多轮对话分摊
+    turns = split_turns(messages)
+    if memory_policy != "summary" or len(turns) <= memory_max_turns * 2:
+        return []
+    return turns[:-memory_max_turns]
+
+
+def build_summary_prompt(summary: str, turns: List[List[BaseMessage]]) -> List[BaseMessage]:
+    transcript = "\n".join(
+        f"{'用户' if message.type == 'human' else '助手'}：{message.content}"
+        for turn in turns for message in turn if message.type in ("human", "ai")
+    )
+    return [
+        SystemMessage(
+            "你负责压缩对话记录。把已有摘要和新的对话合并成一段简洁的摘要，保留用户关心的问题、得到的结论和重要的文档细节，不要编造内容。"
+        ),
+        HumanMessage(f"已有摘要：\n{summary or '无'}\n\n新的对话：\n{transcript}")
+    ]
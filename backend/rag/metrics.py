@@ -0,0 +1,233 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # 每组标签：各桶计数（不累计）、总和、次数
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            bucket_counts, totals = self._values.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0, 0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+                    break
+            else:
+                bucket_counts[-1] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[float, int]]:
+        """各组标签的总和与次数"""
+
+        with self._lock:
+            return {label_values: (totals[0], int(totals[1])) for label_values, (_, totals) in self._values.items()}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (bucket_counts, totals) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), bucket_counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{format_labels(self.label_names, label_values, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {totals[0]}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {int(totals[1])}")
+        return lines
+
+
+class Gauge:
+    """在导出时调用函数取值，用于会话数、已打开的向量库数等当前状态"""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> List[str]:
+        try:
+            value = float(self.read())
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """按Prometheus文本格式导出所有指标"""
+
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.register(Histogram("docqa_stage_seconds", "各阶段耗时（秒）", ("stage",)))
+tokens_total = metrics.register(Counter("docqa_tokens_total", "LLM调用的token数", ("stage", "kind")))
+cache_events_total = metrics.register(Counter("docqa_cache_events_total", "各缓存的命中与未命中次数", ("cache", "result")))
+items_total = metrics.register(Counter("docqa_items_total", "流水线各阶段处理的页数、片段数", ("stage",)))
+
+
+@dataclass
+class Span:
+    stage: str
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    duration: float = 0.0
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@dataclass
+class Trace:
+    name: str
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    spans: List[Span] = field(default_factory=list)
+
+
+# 当前请求的trace，graph节点在子任务中运行时也能取到同一个对象
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[Span]:
+    """记录一个阶段的耗时，写入直方图，处于请求trace中时也加入trace"""
+
+    record = Span(stage, dict(attributes))
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.duration = time.perf_counter() - start
+        stage_seconds.observe(record.duration, stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append(record)
+
+
+@contextmanager
+def trace_request(name: str) -> Iterator[Trace]:
+    """一次请求的trace，结束时在debug级别输出各阶段耗时"""
+
+    trace = Trace(name)
+    token = current_trace.set(trace)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        try:
+            current_trace.reset(token)
+        except ValueError:
+            # 流式响应被客户端中断时，生成器可能在另一个上下文中关闭
+            current_trace.set(None)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("trace %s", json.dumps({
+                "name": trace.name,
+                "trace_id": trace.trace_id,
+                "spans": [{"stage": s.stage, "ms": round(s.duration * 1000, 2), **s.attributes} for s in trace.spans]
+            }, ensure_ascii=False, default=str))
+
+
+def record_stage(stage: str, duration: float, items: int):
+    """记录一个分散在多次调用中的阶段，累计耗时与处理的项数只记一次"""
+
+    record = Span(stage, {"items": items}, duration)
+    stage_seconds.observe(duration, stage)
+    items_total.inc(stage, amount=items)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans.append(record)
+
+
+def timed_iter(iterable: Iterable[T], stage: str) -> Iterator[T]:
+    """流水线中的一段生成器，累计它产出各项所花的时间，结束时记一次耗时"""
+
+    iterator = iter(iterable)
+    duration = 0.0
+    count = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                duration += time.perf_counter() - start
+            count += 1
+            yield item
+    finally:
+        record_stage(stage, duration, count)
+
+
+def record_token_usage(stage: str, message):
+    # usage_metadata由模型返回，部分模型或流式输出时可能没有
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return {}
+    tokens_total.inc(stage, "input", amount=usage.get("input_tokens", 0))
+    tokens_total.inc(stage, "output", amount=usage.get("output_tokens", 0))
+    return {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)}
+
+
+def record_cache_event(cache: str, hit: bool, amount: int = 1):
+    if amount:
+        cache_events_total.inc(cache, "hit" if hit else "miss", amount=amount)
@@ -1,12 +1,28 @@
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+
 from langchain_openai import ChatOpenAI
 from langchain_deepseek import ChatDeepSeek
-from langgraph.graph import MessagesState, StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, END
+from langgraph.runtime import Runtime
 from langchain_core.runnables import RunnableConfig
-from langchain_core.messages import SystemMessage, AIMessage, ToolMessage
+from langchain_core.messages import SystemMessage, AIMessage, ToolMessage, RemoveMessage
 from pydantic import SecretStr
 
+from rag.clients import client_pool
+from rag.context import pack_context, context_token_budget, document_source, used_sources
+from rag.history import history_store
+from rag.metrics import span, record_token_usage, record_cache_event
+from rag.memory import RagState, select_history, prune_tool_messages, turns_to_summarize, build_summary_prompt
+from rag.query_cache import translation_cache, detect_lanuage
+from rag.retrieval import retrieve_documents
 from schemas.DocQA_types import InvokeResponse, DocConfig
+from config import translate_query_mode
+
+
+logger = logging.getLogger(__name__)
 
 
 def build_llm(model_name: str, api_key: SecretStr):
@@ -21,34 +37,34 @@ def build_llm(model_name: str, api_key: SecretStr):
         if model_name == "DeepSeek-V3":
             result.addition_args = {
                 "llm_name": model_name, 
-                "llm": ChatDeepSeek(
+                "llm": client_pool.get_or_create("llm", model_name, api_key, lambda: ChatDeepSeek(
                     model="deepseek-chat",  # ds-V3
                     temperature=0,
                     max_retries=2,
                     api_key=api_key
-                )
+                ))
             }
             return result
         elif model_name == "gpt-3.5-turbo":
             result.addition_args = {
                 "llm_name": model_name,
-                "llm": ChatOpenAI(
+                "llm": client_pool.get_or_create("llm", model_name, api_key, lambda: ChatOpenAI(
                     model="gpt-3.5-turbo",
                     temperature=0,
                     max_retries=2,
                     api_key=api_key
-                )
+                ))
             }
             return result
         elif model_name == "gpt-4":
             result.addition_args = {
                 "llm_name": model_name, 
-                "llm": ChatOpenAI(
+                "llm": client_pool.get_or_create("llm", model_name, api_key, lambda: ChatOpenAI(
                     model="gpt-4",
                     temperature=0,
                     max_retries=2,
                     api_key=api_key
-                )
+                ))
             }
             return result
         else:
@@ -61,150 +77,247 @@ def build_llm(model_name: str, api_key: SecretStr):
         return result
 
 
-def build_rag_graph(doc_config: DocConfig):
-    result = InvokeResponse(
-        source=build_rag_graph.__name__,
-        state=True,
-        message=f"构建Graph成功！"
-    )
+async def translate_query_for_retrieval(doc_config: DocConfig, query: str) -> str:
+    """把问题翻译成检索用的关键词，问题与文档语言相同时可以跳过，翻译结果会缓存"""
+
+    if translate_query_mode == "never":
+        return query
+    if translate_query_mode == "auto" and doc_config.lanuage is not None and detect_lanuage(query) == doc_config.lanuage:
+        return query
+
+    # 缓存的磁盘层是同步的sqlite读写，放到线程里执行，不阻塞事件循环
+    cached_query = await asyncio.to_thread(translation_cache.get, doc_config.llm_name, query)
+    record_cache_event("translation", cached_query is not None)
+    if cached_query is not None:
+        return cached_query
+
+    translate_prompt = [
+        SystemMessage(
+            content=(
+                f"你是一个语言助手，你的任务是将用户的中文问题翻译为适合英文学术文献检索的关键词。\n"
+                f"只返回关键词，不要回答其他内容。\n\n"
+                f"示例：\n"
+                f"用户：这篇论文主要讲了什么？\n"
+                f"输出：abstract, conclusion\n\n"
+                f"用户：这篇论文的研究目标是什么？\n"
+                f"输出：research objective\n\n"
+                f"用户：这篇综述是怎样挑选文献的？\n"
+                f"输出：筛选方法，调查方法\n\n"
+                f"用户：{query}\n"
+                f"输出："
+            )
+        )
+    ]
+    with span("translate") as record:
+        response = await doc_config.llm_model.ainvoke(translate_prompt)
+        record.set(**record_token_usage("translate", response))
+    translate_query = str(response.content)
+    await asyncio.to_thread(translation_cache.set, doc_config.llm_name, query, translate_query)
+
+    return translate_query
 
-    if doc_config.llm_model is None:
-        result.state = False
-        result.message = "请先配置模型！"
-        return result
-    elif doc_config.vector_store is None:
-        result.state = False
-        result.message = "请先上传文件并构建向量库！"
-        return result
 
-    def retrieve_node(state: MessagesState):
-        """检索文档中与query相关的信息"""
-
-        print("ai.retrieve_node - 开始检索")
-
-        # 获取最后一条HumanMessage
-        query = None
-        for message in state["messages"][::-1]:
-            if message.type == "human":
-                query = message.content
-
-        if query is None:
-            return {"messages": [AIMessage(content="我没有收到你的问题。")]}
-
-        translate_prompt = [
-            SystemMessage(
-                content=(
-                    f"你是一个语言助手，你的任务是将用户的中文问题翻译为适合英文学术文献检索的关键词。\n"
-                    f"只返回关键词，不要回答其他内容。\n\n"
-                    f"示例：\n"
-                    f"用户：这篇论文主要讲了什么？\n"
-                    f"输出：abstract, conclusion\n\n"
-                    f"用户：这篇论文的研究目标是什么？\n"
-                    f"输出：research objective\n\n"
-                    f"用户：这篇综述是怎样挑选文献的？\n"
-                    f"输出：筛选方法，调查方法\n\n"
-                    f"用户：{query}\n"
-                    f"输出："
-                )
+def build_system_prompt(doc_config: DocConfig) -> SystemMessage:
+    # 角色设定，每次生成时根据当前文档现场拼接，不写入对话记录
+    if doc_config.corpus_documents is not None:
+        file_names = "、".join(f"《{document['file_name']}》" for document in doc_config.corpus_documents)
+        return SystemMessage(
+            content=(
+                f"你是一个文档助手，用户可能会叫你{doc_config.llm_name}。"
+                f"用户选择了{len(doc_config.corpus_documents)}份文档：{file_names}，当提到“文章”、“文档”或“论文”等时一般指的就是这些文档。"
+                "每次用户提问时，系统会先从这些文档中为你检索一些相关内容，每段内容前标注了出处，请你根据这些内容认真作答，并说明答案来自哪份文档。"
+                "如果根据文档无法回答，就说不知道。"
             )
-        ]
-        translate_query = doc_config.llm_model.invoke(translate_prompt).content
+        )
+    return SystemMessage(
+        content=(
+            f"你是一个文档助手，用户可能会叫你{doc_config.llm_name}。"
+            f"用户上传了一份{doc_config.lanuage}文档《{doc_config.file_name}》，当提到“文章”、“文档”或“论文”等时一般指的就是这个文档。"
+            "每次用户提问时，系统会先为你检索一些相关的文档内容，请你根据这些内容认真作答。"
+            "如果根据文档无法回答，就说不知道。"
+        )
+    )
+
+
+@dataclass
+class RagContext:
+    """运行时传入graph的文档配置，graph本身与具体文档无关"""
+    doc_config: DocConfig
+
 
-        print(f"ai.retrieve_node - 翻译的query: {translate_query}")
+async def retrieve_node(state: RagState, runtime: Runtime[RagContext]):
+    """检索文档中与query相关的信息"""
 
-        retrieved_docs = doc_config.vector_store.similarity_search(translate_query, k=3)
+    doc_config = runtime.context.doc_config
+
+    # 获取最后一条HumanMessage
+    query = None
+    for message in state["messages"][::-1]:
+        if message.type == "human":
+            query = message.content
+            break
+
+    if query is None:
+        return {"messages": [AIMessage(content="我没有收到你的问题。")]}
+
+    translate_query = await translate_query_for_retrieval(doc_config, query)
+
+    logger.debug("retrieve_node - 翻译的query: %s", translate_query)
+
+    # BM25检索同时使用原问题和翻译的关键词，公式名、缩写、章节号等原词也能命中
+    lexical_query = query if translate_query == query else f"{query}\n{translate_query}"
+    with span("retrieve") as record:
+        candidates = await retrieve_documents(doc_config, translate_query, lexical_query)
+        # 按模型的token预算选出实际放入提示词的片段，引用只展示这些片段
+        used = used_sources([document_source(doc) for doc in candidates], context_token_budget(doc_config.llm_name), doc_config.corpus_documents is not None)
+        retrieved_docs = [candidates[i] for i in used]
+        record.set(candidates=len(candidates), chunks=len(retrieved_docs))
+    if doc_config.corpus_documents is not None:
+        # 跨文档检索时标注每段内容的出处
+        serialized = "\n\n".join(f"《{doc.metadata.get('file_name')}》第{(doc.metadata.get('page') or 0) + 1}页：{doc.page_content}" for doc in retrieved_docs)
+    else:
         serialized = "\n\n".join(f"{doc.page_content}" for doc in retrieved_docs)
 
-        print("ai.retrieve_node - 完成检索，检索内容：")
-        for i, s in enumerate(serialized.split("\n\n")):
-            print(f"{str(i)}. {s}")
-        print("\n\n")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("retrieve_node - 检索内容：\n%s", "\n".join(f"{i}. {s}" for i, s in enumerate(serialized.split("\n\n"))))
 
-        tool_response = ToolMessage(
-            tool_call_id="node_force_call",
-            tool_name="retrieve",
-            content=serialized
-        )
+    # artifact记录检索片段的来源页码，供前端展示引用
+    tool_response = ToolMessage(
+        tool_call_id="node_force_call",
+        tool_name="retrieve",
+        content=serialized,
+        artifact=[document_source(doc) for doc in retrieved_docs]
+    )
+
+    # 返回检索出的相关片段拼接的文本和原始数据列表
+    return {"messages": [tool_response]}
 
-        # 返回检索出的相关片段拼接的文本和原始数据列表
-        return {"messages": [tool_response]}
 
-    def generate_node(state: MessagesState):
-        """根据检索的内容生成答复"""
+def pack_sources(doc_config: DocConfig, sources) -> str:
+    # 检索片段合并相邻部分、去掉重复后按模型的token预算放入提示词
+    with span("context_pack", chunks=len(sources)) as record:
+        blocks = pack_context(sources, context_token_budget(doc_config.llm_name), doc_config.corpus_documents is not None)
+        record.set(blocks=len(blocks))
+    return "\n\n".join(blocks)
 
-        print("ai.generate_node - 开始生成回复")
 
-        # 获得ToolMessages
-        recent_tool_messages = []
-        for message in reversed(state["messages"]):
-            if message.type == "tool":
-                recent_tool_messages.append(message)
-            else:
-                break
-        tool_messages = recent_tool_messages[::-1]
+def build_context_prompt(docs_content: str) -> SystemMessage:
+    return SystemMessage(
+        "这是retrive返回的信息，参考下边从文档中检索的内容回答问题，如果你根据这些信息也无法回答的话就回答不知道。使用简洁清楚的语句回答。\n\n"
+        f"{docs_content}"
+    )
+
 
-        # 提示词
+async def generate_node(state: RagState, runtime: Runtime[RagContext]):
+    """根据检索的内容生成答复"""
+
+    doc_config = runtime.context.doc_config
+
+    # 获得ToolMessages
+    recent_tool_messages = []
+    for message in reversed(state["messages"]):
+        if message.type == "tool":
+            recent_tool_messages.append(message)
+        else:
+            break
+    tool_messages = recent_tool_messages[::-1]
+
+    # 提示词
+    sources = [source for message in tool_messages for source in (getattr(message, "artifact", None) or [])]
+    if sources:
+        docs_content = pack_sources(doc_config, sources)
+    else:
         docs_content = "\n\n".join(doc.content for doc in tool_messages)
-        system_message_content = (
-            "这是retrive返回的信息，参考下边从文档中检索的内容回答问题，如果你根据这些信息也无法回答的话就回答不知道。使用简洁清楚的语句回答。\n\n"
-            f"{docs_content}"
-        )
-        conversation_messages = [message for message in state["messages"] if message.type in ("human", "system") or (message.type == "ai" and not message.tool_calls)]
-        prompt = [SystemMessage(system_message_content)] + conversation_messages
+    # 按记忆策略截取对话，提示词长度不随对话轮数增长
+    prompt = [build_system_prompt(doc_config), build_context_prompt(docs_content)] + select_history(state)
 
-        print("ai.generate_node - 提示词：")
-        print(prompt[0].content)
-        print("\n\n")
+    logger.debug("generate_node - 提示词：\n%s", prompt[1].content)
 
-        # 向LLM问话
-        response = doc_config.llm_model.invoke(prompt)
+    # 向LLM问话
+    with span("generate") as record:
+        response = await doc_config.llm_model.ainvoke(prompt)
+        record.set(**record_token_usage("generate", response))
 
-        print("ai.generate_node - 结束，回复：")
-        print(response)
-        print("="*40, "\n\n")
+    logger.debug("generate_node - 回复：%s", response)
 
-        return {"messages": [response]}
-    
-    
-    # 初始角色设定
-    initial_message = SystemMessage(
-        content=(
-            f"你是一个文档助手，用户可能会叫你{doc_config.llm_name}。"
-            f"用户上传了一份{doc_config.lanuage}文档《{doc_config.file_name}》，当提到“文章”、“文档”或“论文”等时一般指的就是这个文档。"
-            "每次用户提问时，系统会先为你检索一些相关的文档内容，请你根据这些内容认真作答。"
-            "如果根据文档无法回答，就说不知道。"
-        )
+    # 之前各轮的检索结果不会再用到，从checkpoint中删掉
+    return {"messages": [response] + prune_tool_messages(state["messages"])}
+
+
+async def summarize_node(state: RagState, runtime: Runtime[RagContext]):
+    """summary策略下把较早的对话折叠进摘要，并从checkpoint中删除"""
+
+    turns = turns_to_summarize(state["messages"])
+    if not turns:
+        return {}
+
+    doc_config = runtime.context.doc_config
+    with span("summarize") as record:
+        response = await doc_config.llm_model.ainvoke(build_summary_prompt(state.get("summary", ""), turns))
+        record.set(**record_token_usage("summarize", response))
+
+    return {
+        "summary": str(response.content),
+        "messages": [RemoveMessage(id=message.id) for turn in turns for message in turn if message.id is not None]
+    }
+
+
+def compile_rag_graph():
+    graph_builder = StateGraph(RagState, context_schema=RagContext)
+    graph_builder.add_node(retrieve_node)
+    graph_builder.add_node(generate_node)
+    graph_builder.add_node(summarize_node)
+
+    graph_builder.set_entry_point("retrieve_node")
+    graph_builder.add_edge("retrieve_node", "generate_node")
+    graph_builder.add_edge("generate_node", "summarize_node")
+    graph_builder.add_edge("summarize_node", END)
+
+    # 不使用checkpointer，对话记录由history_store按轮增量保存，调用时随输入传入
+    return graph_builder.compile()
+
+
+# graph只编译一次，文档、向量库、模型都在调用时通过context传入
+rag_graph = compile_rag_graph()
+
+
+async def build_rag_graph(doc_config: DocConfig):
+    result = InvokeResponse(
+        source=build_rag_graph.__name__,
+        state=True,
+        message=f"构建Graph成功！"
     )
 
-    try:
-        graph_builder = StateGraph(MessagesState)
-        graph_builder.add_node(retrieve_node)
-        graph_builder.add_node(generate_node)
-
-        graph_builder.set_entry_point("retrieve_node")
-        graph_builder.add_edge("retrieve_node", "generate_node")
-        graph_builder.add_edge("generate_node", END)
-
-        # 记录历史记录
-        memory = MemorySaver()
-        config = RunnableConfig({"configurable": {"thread_id": "1"}})
-        graph = graph_builder.compile(checkpointer=memory)
-    except Exception as e:
+    if doc_config.llm_model is None:
         result.state = False
-        result.message = f"构建Graph失败！\n{e}"
+        result.message = "请先配置模型！"
         return result
-
-    # 加入初始SystemMessage
-    try:
-        graph.invoke({"messages": [initial_message]}, config=config)
-    except Exception as e:
+    elif doc_config.vector_store is None and doc_config.corpus_documents is None:
         result.state = False
-        result.message = f"构建Graph失败！\n{e}"
+        result.message = "请先上传文件并构建向量库！"
+        return result
+    elif doc_config.corpus_documents is not None and doc_config.embedding_model is None:
+        result.state = False
+        result.message = "请先配置embedding model!"
         return result
 
+    # 每个会话的每个文档使用独立的对话线程，之前聊过的从历史记录中恢复
+    if doc_config.thread_id is None:
+        if doc_config.corpus_documents is not None:
+            # 选择同一组文档时接着之前的对话
+            corpus_id = hashlib.sha256("\n".join(sorted(document["doc_id"] for document in doc_config.corpus_documents)).encode("utf-8")).hexdigest()[:16]
+            doc_config.thread_id = f"{doc_config.session_id or 'default'}:corpus:{corpus_id}"
+        else:
+            doc_config.thread_id = f"{doc_config.session_id or 'default'}:{doc_config.file_hash or doc_config.file_name}"
+        saved_document = await asyncio.to_thread(history_store.get_document, doc_config.thread_id)
+        if saved_document is not None:
+            doc_config.chat_history = await asyncio.to_thread(history_store.load_messages, doc_config.thread_id)
+            doc_config.chat_summary = saved_document["summary"]
+
     result.addition_args = {
-        "graph": graph,
-        "graph_config": config
+        "graph": rag_graph,
+        "graph_config": RunnableConfig({"configurable": {"thread_id": doc_config.thread_id}}),
+        "graph_context": RagContext(doc_config=doc_config)
     }
 
     return result
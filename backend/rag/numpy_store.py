@@ -0,0 +1,214 @@
+import os
+import json
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+numpy_store_file_name = "numpy_store.json"
+numpy_vectors_file_name = "numpy_vectors.npy"
+numpy_scales_file_name = "numpy_scales.npy"
+
+numpy_store_dtypes = ("float32", "float16", "int8")
+
+# 分块计算相似度，int8、float16转成float32时临时内存不随片段数增长
+search_block_rows = 2048
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """把归一化后的向量转成存储类型，int8每行一个缩放系数"""
+
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(dtype), np.ones(len(vectors), dtype=np.float32)
+
+
+class NumpyVectorStore(VectorStore):
+    """进程内的向量库，向量按行存成矩阵，检索是一次矩阵乘法
+
+    持久化后以内存映射方式打开，不必把整个矩阵读进内存；写入只追加，适合单文档的几千个片段。
+    """
+
+    def __init__(self, embedding_function: Embeddings, persist_directory: Optional[str] = None, dtype: str = "float32"):
+        assert dtype in numpy_store_dtypes
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.dtype = dtype
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self._id_index: Dict[str, int] = {}
+        self._vectors = np.zeros((0, 0), dtype=dtype)
+        self._scales = np.zeros(0, dtype=np.float32)
+        # 构建期间新写入的向量，检索或持久化时再合并进矩阵
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        blocks = ([self._vectors] if len(self._vectors) else []) + [vectors for vectors, _ in self._pending]
+        scales = [self._scales] + [scales for _, scales in self._pending]
+        self._vectors = np.concatenate(blocks)
+        self._scales = np.concatenate(scales)
+        self._pending = []
+
+    def upsert(self, ids: List[str], embeddings: Sequence[Sequence[float]], metadatas: List[Dict[str, Any]], documents: List[str]):
+        """与Chroma collection的upsert参数一致，已存在的id原地覆盖"""
+
+        vectors, scales = quantize(normalize_rows(np.asarray(embeddings, dtype=np.float32)), self.dtype)
+
+        new_rows = []
+        for row, doc_id in enumerate(ids):
+            if doc_id in self._id_index:
+                self._merge_pending()
+                # 内存映射打开的矩阵是只读的，覆盖前先复制一份
+                if not self._vectors.flags.writeable:
+                    self._vectors = np.array(self._vectors)
+                i = self._id_index[doc_id]
+                self._vectors[i], self._scales[i] = vectors[row], scales[row]
+                self.documents[i], self.metadatas[i] = documents[row], metadatas[row]
+            else:
+                self._id_index[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+                self.documents.append(documents[row])
+                self.metadatas.append(metadatas[row])
+                new_rows.append(row)
+
+        if new_rows:
+            self._pending.append((vectors[new_rows], scales[new_rows]))
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, *, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        self.upsert(ids, self.embedding_function.embed_documents(texts), metadatas or [{} for _ in texts], texts)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return True
+        self._merge_pending()
+        removed = {self._id_index[doc_id] for doc_id in ids if doc_id in self._id_index}
+        keep = [i for i in range(len(self.ids)) if i not in removed]
+        self._vectors = self._vectors[keep] if len(self._vectors) else self._vectors
+        self._scales = self._scales[keep]
+        self.ids = [self.ids[i] for i in keep]
+        self.documents = [self.documents[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self._id_index = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return True
+
+    def _document(self, i: int) -> Document:
+        return Document(page_content=self.documents[i], metadata=self.metadatas[i], id=self.ids[i])
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        return [self._document(self._id_index[doc_id]) for doc_id in ids if doc_id in self._id_index]
+
+    def get(self, ids: Optional[Sequence[str]] = None, include: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        # 返回格式与Chroma.get一致，include中有embeddings时返回还原成float32的归一化向量
+        rows = range(len(self.ids)) if ids is None else [self._id_index[doc_id] for doc_id in ids if doc_id in self._id_index]
+        result = {
+            "ids": [self.ids[i] for i in rows],
+            "documents": [self.documents[i] for i in rows],
+            "metadatas": [self.metadatas[i] for i in rows]
+        }
+        if include is not None and "embeddings" in include:
+            self._merge_pending()
+            rows = list(rows)
+            result["embeddings"] = self._vectors[rows].astype(np.float32) * self._scales[rows][:, None] if rows else np.zeros((0, 0), dtype=np.float32)
+        return result
+
+    def search_by_vectors(self, queries: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        """一次检索多个问题，返回每个问题前k个片段的行号和余弦相似度"""
+
+        self._merge_pending()
+        if not self.ids:
+            return [[] for _ in queries]
+
+        queries = normalize_rows(np.asarray(queries, dtype=np.float32))
+        scores = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), search_block_rows):
+            block = self._vectors[start:start + search_block_rows]
+            scores[:, start:start + len(block)] = (queries @ block.astype(np.float32, copy=False).T) * self._scales[start:start + len(block)]
+
+        k = min(k, len(self.ids))
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind="stable")]
+            results.append([(int(i), float(row[i])) for i in top])
+        return results
+
+    def similarity_search_by_vectors(self, embeddings: Sequence[Sequence[float]], k: int = 4) -> List[List[Document]]:
+        # 多个问题一起检索时只做一次矩阵乘法
+        return [[self._document(i) for i, _ in hits] for hits in self.search_by_vectors(np.asarray(embeddings), k)]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        return [(self._document(i), score) for i, score in self.search_by_vectors(np.asarray([embedding]), k)[0]]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        # 编码走模型的异步接口，矩阵乘法很快，直接在事件循环中计算
+        embedding = await self.embedding_function.aembed_query(query)
+        return self.similarity_search_by_vector(embedding, k)
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, *, ids: Optional[List[str]] = None, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def persist(self):
+        assert self.persist_directory is not None
+        self._merge_pending()
+
+        # 先写临时文件再替换，与向量库清单的写法一致
+        for file_name, array_ in ((numpy_vectors_file_name, self._vectors), (numpy_scales_file_name, self._scales)):
+            path = os.path.join(self.persist_directory, file_name)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array_)
+            os.replace(path + ".tmp", path)
+
+        path = os.path.join(self.persist_directory, numpy_store_file_name)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "ids": self.ids, "documents": self.documents, "metadatas": self.metadatas}, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, persist_directory: str, embedding_function: Embeddings) -> "NumpyVectorStore":
+        with open(os.path.join(persist_directory, numpy_store_file_name), "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        store = cls(embedding_function, persist_directory, data["dtype"])
+        store.ids, store.documents, store.metadatas = data["ids"], data["documents"], data["metadatas"]
+        store._id_index = {doc_id: i for i, doc_id in enumerate(store.ids)}
+        # 向量矩阵以只读内存映射打开，由操作系统按需换入
+        store._vectors = np.load(os.path.join(persist_directory, numpy_vectors_file_name), mmap_mode="r")
+        store._scales = np.load(os.path.join(persist_directory, numpy_scales_file_name))
+        return store
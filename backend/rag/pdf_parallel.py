@@ -0,0 +1,93 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional
+
+import pypdf
+from langchain_core.documents import Document
+
+from schemas.DocQA_types import IngestJob
+
+
+def count_pdf_pages(file_path: str) -> int:
+    return len(pypdf.PdfReader(file_path).pages)
+
+
+def pdf_metadata(reader: pypdf.PdfReader, file_path: str) -> Dict[str, Any]:
+    """文档级元数据，键名和取值的格式与PyPDFLoader一致：/Producer写成producer，日期转成ISO格式"""
+
+    metadata: Dict[str, Any] = {}
+    raw = {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""} | dict(reader.metadata or {}) | {"source": file_path, "total_pages": len(reader.pages)}
+    for key, value in raw.items():
+        key = key.removeprefix("/").lower()
+        if not isinstance(value, (str, int)):
+            value = str(value)
+        if key in ("creationdate", "moddate"):
+            try:
+                value = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        elif isinstance(value, str):
+            value = value.strip()
+        metadata[key] = value
+        # 与其他PDF解析器统一的键名
+        if key == "page_count":
+            metadata["total_pages"] = value
+        elif key == "file_path":
+            metadata["source"] = value
+    return metadata
+
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[Document]:
+    """在子进程中提取[start, end)页的文本，元数据与PyPDFLoader保持一致"""
+
+    reader = pypdf.PdfReader(file_path)
+    doc_metadata = pdf_metadata(reader, file_path)
+
+    return [
+        Document(
+            page_content=reader.pages[page_number].extract_text(extraction_mode="plain").strip(),
+            metadata=doc_metadata | {"page": page_number, "page_label": reader.page_labels[page_number]}
+        )
+        for page_number in range(start, end)
+    ]
+
+
+def iter_pdf_pages_serial(file_path: str, pages_per_task: int) -> Iterator[Document]:
+    """在当前进程中逐页提取文本，元数据与PyPDFLoader保持一致"""
+
+    # 传入文件对象时pypdf按需读取，传入路径时会把整个文件读进内存
+    with open(file_path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        doc_metadata = pdf_metadata(reader, file_path)
+        page_labels = reader.page_labels
+        for page_number, page in enumerate(reader.pages):
+            text = page.extract_text(extraction_mode="plain").strip()
+            # reader会缓存解析过的字体、内容流等对象，每pages_per_task页清空一次，内存不随页数增长，字体也不必每页重新解析
+            if (page_number + 1) % pages_per_task == 0:
+                reader.resolved_objects.clear()
+            yield Document(page_content=text, metadata=doc_metadata | {"page": page_number, "page_label": page_labels[page_number]})
+
+
+def iter_pdf_pages_parallel(file_path: str, total_pages: int, workers: int, pages_per_task: int, job: Optional[IngestJob] = None) -> Iterator[Document]:
+    """把页码区间分给多个进程提取文本，按页码顺序逐页返回"""
+
+    page_ranges = iter([(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)])
+
+    # 服务进程里有多个线程，用spawn而不是fork创建子进程
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        # 只预先提交有限个区间，按提交顺序取回，保证页序且内存不随页数增长
+        pending = deque(executor.submit(extract_page_range, file_path, start, end) for start, end in islice(page_ranges, workers * 2))
+        while pending:
+            pages = pending.popleft().result()
+            for start, end in islice(page_ranges, 1):
+                pending.append(executor.submit(extract_page_range, file_path, start, end))
+            for page in pages:
+                if job is not None:
+                    job.pages_parsed += 1
+                yield page
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,8 +1,109 @@
-from langchain_core.messages import HumanMessage
+import uuid
+import asyncio
+import logging
+
+from langchain_core.messages import HumanMessage, AIMessage
+
+from rag.answer_cache import answer_cache
+from rag.history import history_store
+from rag.metrics import span, record_cache_event
+from rag.query_cache import normalize_question
 from schemas.DocQA_types import DocConfig, InvokeResponse
+from config import answer_cache_enabled
+
+
+logger = logging.getLogger(__name__)
+
+def answer_cache_usable(doc_config: DocConfig) -> bool:
+    # 跨文档问答的检索范围随选择的文档变化，不使用缓存
+    return answer_cache_enabled and doc_config.corpus_documents is None and doc_config.file_hash is not None and doc_config.llm_name is not None and doc_config.embedding_model is not None
+
+
+def last_turn_sources(messages):
+    # 最后一轮检索得到的ToolMessage中记录了来源
+    sources = []
+    for message in reversed(messages):
+        if message.type == "tool":
+            sources = (getattr(message, "artifact", None) or []) + sources
+        elif message.type == "ai":
+            continue
+        else:
+            break
+    return sources
 
 
-def qa_answer(doc_config: DocConfig, question: str):
+def build_graph_input(doc_config: DocConfig, question: str):
+    # graph不保存状态，每轮把当前的对话记录和摘要连同新问题一起传入
+    return {
+        "messages": list(doc_config.chat_history or []) + [HumanMessage(content=question, id=str(uuid.uuid4()))],
+        "summary": doc_config.chat_summary
+    }
+
+
+async def save_turn(doc_config: DocConfig, graph_input, values):
+    """对比这一轮传入graph的对话和graph返回的对话，把新增和被裁剪的消息写入历史记录"""
+
+    # graph_input的最后一条是这一轮的问题，需要作为新增消息保存
+    old_ids = {message.id for message in graph_input["messages"][:-1]}
+    new_ids = {message.id for message in values["messages"]}
+    appended = [message for message in values["messages"] if message.id not in old_ids]
+    removed_ids = [message_id for message_id in old_ids if message_id not in new_ids]
+
+    doc_config.chat_history = values["messages"]
+    doc_config.chat_summary = values.get("summary", "")
+    await asyncio.to_thread(history_store.save_turn, doc_config, appended, removed_ids)
+
+
+async def lookup_cached_answer(doc_config: DocConfig, question: str):
+    """在语义缓存中查找相似问题的回答，命中时把这一轮问答写入对话记录；调用方需持有doc_config.turn_lock"""
+
+    result = InvokeResponse(
+        source=lookup_cached_answer.__name__,
+        state=False,
+        message="未命中缓存。"
+    )
+
+    if not answer_cache_usable(doc_config) or doc_config.graph is None:
+        return result
+
+    # 大小写、标点不同的同一问题得到同样的向量
+    # 缓存只是加速，编码或查找出错时当作未命中，照常检索、生成
+    try:
+        with span("answer_lookup"):
+            question_vector = await doc_config.embedding_model.aembed_query(normalize_question(question))
+            cached = answer_cache.lookup(doc_config.file_hash, doc_config.embedding_model_name, doc_config.llm_name, question_vector)  # type: ignore[arg-type]
+    except Exception as e:
+        logger.warning("查找语义缓存失败，按未命中处理：%s", e)
+        record_cache_event("answer", False)
+        return result
+    result.addition_args = {"question_vector": question_vector}
+
+    record_cache_event("answer", cached is not None)
+    if cached is None:
+        return result
+
+    graph_input = build_graph_input(doc_config, question)
+    values = {**graph_input, "messages": graph_input["messages"] + [AIMessage(content=cached["answer"], id=str(uuid.uuid4()))]}
+    await save_turn(doc_config, graph_input, values)
+
+    result.state = True
+    result.message = "命中语义缓存！"
+    result.addition_args = {
+        "response": values,
+        "sources": cached["sources"],
+        "similarity": cached["similarity"]
+    }
+
+    return result
+
+
+def remember_answer(doc_config: DocConfig, question: str, question_vector, messages):
+    if question_vector is None or not answer_cache_usable(doc_config) or messages[-1].type != "ai":
+        return
+    answer_cache.add(doc_config.file_hash, doc_config.embedding_model_name, doc_config.llm_name, question, question_vector, messages[-1].content, last_turn_sources(messages))  # type: ignore[arg-type]
+
+
+async def qa_answer(doc_config: DocConfig, question: str):
     # 用 LangChain 进行 RAG 问答
 
     result = InvokeResponse(
@@ -13,8 +114,18 @@ def qa_answer(doc_config: DocConfig, question: str):
 
     try:
         if doc_config.graph is not None:
-            response = doc_config.graph["graph"].invoke({"messages": [HumanMessage(content=question)]}, config=doc_config.graph["graph_config"])
-            result.addition_args = {"response": response}
+            async with doc_config.turn_lock:
+                cache_result = await lookup_cached_answer(doc_config, question)
+                if cache_result.state and cache_result.addition_args is not None:
+                    result.message = cache_result.message
+                    result.addition_args = {"response": cache_result.addition_args["response"], "cache_hit": True}
+                    return result
+
+                graph_input = build_graph_input(doc_config, question)
+                response = await doc_config.graph["graph"].ainvoke(graph_input, config=doc_config.graph["graph_config"], context=doc_config.graph["graph_context"])
+                await save_turn(doc_config, graph_input, response)
+            remember_answer(doc_config, question, (cache_result.addition_args or {}).get("question_vector"), response["messages"])
+            result.addition_args = {"response": response, "cache_hit": False}
         else:
             result.state = False
             result.message = "请先创建graph!"
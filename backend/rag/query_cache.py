@@ -0,0 +1,94 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from config import translation_cache_size, translation_cache_ttl, translation_cache_file
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?？。.!！ ")
+
+
+def detect_lanuage(text: str) -> str:
+    """粗略判断文本语言，中文字符占比较高时认为是中文"""
+
+    cjk_count = len(re.findall(r"[一-鿿]", text))
+    latin_count = len(re.findall(r"[A-Za-z]", text))
+    if cjk_count == 0 and latin_count == 0:
+        return "unknown"
+    # 一个汉字的信息量大约相当于几个字母
+    return "简体中文" if cjk_count * 3 >= latin_count else "English"
+
+
+class TranslationCache:
+    """翻译后的检索query缓存，内存中LRU+TTL，可选持久化到sqlite"""
+
+    def __init__(self, max_size: int, ttl: float, db_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # 模块导入时缓存目录可能还没创建，第一次用到时再建表
+        assert self.db_path is not None
+        if not self._table_ready:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+            self._table_ready = True
+        return sqlite3.connect(self.db_path)
+
+    @staticmethod
+    def _key(model_name: Optional[str], question: str) -> str:
+        return hashlib.sha256(f"{model_name}\x00{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, value: str, created_at: float):
+        with self._lock:
+            self._items[key] = (created_at, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get(self, model_name: Optional[str], question: str) -> Optional[str]:
+        key = self._key(model_name, question)
+        now = time.time()
+
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if now - item[0] <= self.ttl:
+                    self._items.move_to_end(key)
+                    return item[1]
+                del self._items[key]
+
+        if self.db_path is None:
+            return None
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM translations WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None
+
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def set(self, model_name: Optional[str], question: str, value: str):
+        key = self._key(model_name, question)
+        now = time.time()
+        self._remember(key, value, now)
+
+        if self.db_path is not None:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO translations (key, value, created_at) VALUES (?, ?, ?)", (key, value, now))
+
+
+translation_cache = TranslationCache(translation_cache_size, translation_cache_ttl, translation_cache_file)
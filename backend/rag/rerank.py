@@ -0,0 +1,97 @@
+import math
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import List, Sequence
+
+from langchain_core.documents import Document
+
+from rag.lexical import tokenize
+from config import reranker_model, rerank_mmr_lambda, bm25_k1, bm25_b
+
+
+logger = logging.getLogger(__name__)
+
+cross_encoders = {}
+cross_encoders_lock = threading.Lock()
+
+
+def load_cross_encoder(model_name: str):
+    """加载本地cross-encoder，未安装sentence_transformers时返回None，改用词法打分"""
+
+    with cross_encoders_lock:
+        if model_name not in cross_encoders:
+            try:
+                from sentence_transformers import CrossEncoder
+                cross_encoders[model_name] = CrossEncoder(model_name, device="cpu")
+            except Exception as e:
+                logger.warning("加载%s失败，使用词法打分：%s", model_name, e)
+                cross_encoders[model_name] = None
+        return cross_encoders[model_name]
+
+
+def lexical_scores(query: str, candidates: Sequence[Document]) -> List[float]:
+    # 在候选集合内按BM25打分，候选只有几十个，现场统计词频即可
+    query_terms = set(tokenize(query))
+    doc_counts = [Counter(tokenize(doc.page_content)) for doc in candidates]
+    doc_lens = [sum(counts.values()) for counts in doc_counts]
+    avg_doc_len = max(sum(doc_lens) / max(len(doc_lens), 1), 1.0)
+
+    scores = []
+    for counts, doc_len in zip(doc_counts, doc_lens):
+        score = 0.0
+        for term in query_terms:
+            tf = counts.get(term, 0)
+            if tf == 0:
+                continue
+            df = sum(1 for other in doc_counts if term in other)
+            idf = math.log(1 + (len(candidates) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (bm25_k1 + 1) / (tf + bm25_k1 * (1 - bm25_b + bm25_b * doc_len / avg_doc_len))
+        scores.append(score)
+    return scores
+
+
+def relevance_scores(query: str, candidates: Sequence[Document]) -> List[float]:
+    """候选与问题的相关度，归一化到0~1"""
+
+    encoder = load_cross_encoder(reranker_model) if reranker_model else None
+    if encoder is not None:
+        logits = encoder.predict([(query, doc.page_content) for doc in candidates])
+        return [1 / (1 + math.exp(-float(logit))) for logit in logits]
+
+    # 没有cross-encoder时，词法得分与检索名次各占一半
+    scores = lexical_scores(query, candidates)
+    max_score = max(scores, default=0.0) or 1.0
+    return [0.5 * score / max_score + 0.5 / (rank + 1) for rank, score in enumerate(scores)]
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def mmr_order(candidates: Sequence[Document], relevance: Sequence[float], lambda_: float) -> List[int]:
+    # 相邻片段有chunk_overlap的重叠，按最大边际相关性排序，避免前几名是几乎相同的内容
+    token_sets = [set(tokenize(doc.page_content)) for doc in candidates]
+    remaining = list(range(len(candidates)))
+    selected: List[int] = []
+    while remaining:
+        best = max(remaining, key=lambda i: lambda_ * relevance[i] - (1 - lambda_) * max((jaccard(token_sets[i], token_sets[j]) for j in selected), default=0.0))
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def rerank_documents(query: str, candidates: Sequence[Document]) -> List[Document]:
+    """返回重新排序后的全部候选，放入多少由生成时按模型的token预算决定"""
+
+    if len(candidates) <= 1:
+        return list(candidates)
+    relevance = relevance_scores(query, candidates)
+    order = mmr_order(candidates, relevance, rerank_mmr_lambda)
+    return [candidates[i] for i in order]
+
+
+async def arerank_documents(query: str, candidates: Sequence[Document]) -> List[Document]:
+    # cross-encoder推理占用CPU，放到线程中执行
+    return await asyncio.to_thread(rerank_documents, query, candidates)
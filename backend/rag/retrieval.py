@@ -0,0 +1,104 @@
+import asyncio
+from typing import Dict, List, Sequence
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from rag.corpus import corpus_search
+from rag.lexical import reciprocal_rank_fusion
+from rag.metrics import span
+from rag.numpy_store import NumpyVectorStore
+from rag.rerank import arerank_documents
+from schemas.DocQA_types import DocConfig
+from config import hybrid_search_enabled, retrieval_candidate_k, rrf_k, rerank_enabled, rerank_candidate_k
+
+
+def document_key(doc: Document) -> str:
+    # 没有id的向量库按内容区分片段
+    return doc.id if doc.id is not None else doc.page_content
+
+
+def search_by_vectors(vector_store: VectorStore, query_vectors: Sequence[List[float]], k: int) -> List[List[Document]]:
+    """一次检索多个问题向量，numpy向量库和Chroma都支持批量查询，其他向量库逐个检索"""
+
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.similarity_search_by_vectors(query_vectors, k)
+    if isinstance(vector_store, Chroma):
+        results = vector_store._collection.query(query_embeddings=list(query_vectors), n_results=k, include=["documents", "metadatas"])  # type: ignore[arg-type]
+        return [
+            [Document(page_content=document or "", metadata=metadata or {}, id=doc_id) for doc_id, document, metadata in zip(ids, documents, metadatas)]
+            for ids, documents, metadatas in zip(results["ids"], results["documents"], results["metadatas"])  # type: ignore[arg-type]
+        ]
+    return [vector_store.similarity_search_by_vector(query_vector, k=k) for query_vector in query_vectors]
+
+
+async def fuse_candidates(doc_config: DocConfig, vector_docs: List[Document], lexical_query: str, k: int) -> List[Document]:
+    with span("lexical_search"):
+        lexical_hits = doc_config.lexical_index.search(lexical_query, max(k, retrieval_candidate_k))
+
+    fused = reciprocal_rank_fusion([[document_key(doc) for doc in vector_docs], [doc_id for doc_id, _ in lexical_hits]], rrf_k)[:k]
+
+    # 只被BM25检索到的片段从向量库中按id取出内容
+    docs_by_key: Dict[str, Document] = {document_key(doc): doc for doc in vector_docs}
+    missing_ids = [doc_id for doc_id, _ in fused if doc_id not in docs_by_key]
+    if missing_ids:
+        for doc in await doc_config.vector_store.aget_by_ids(missing_ids):
+            docs_by_key[document_key(doc)] = doc
+
+    return [docs_by_key[doc_id] for doc_id, _ in fused if doc_id in docs_by_key]
+
+
+async def search_candidates(doc_config: DocConfig, vector_query: str, lexical_query: str, k: int) -> List[Document]:
+    """向量检索与BM25检索的结果按倒数排名融合，没有倒排索引时只用向量检索"""
+
+    if doc_config.corpus_documents is not None:
+        with span("corpus_search", documents=len(doc_config.corpus_documents)):
+            return await corpus_search(doc_config.corpus_documents, doc_config.embedding_model, vector_query, lexical_query if hybrid_search_enabled else None, k)
+
+    if not hybrid_search_enabled or doc_config.lexical_index is None:
+        with span("vector_search"):
+            return await doc_config.vector_store.asimilarity_search(vector_query, k=k)
+
+    with span("vector_search"):
+        vector_docs = await doc_config.vector_store.asimilarity_search(vector_query, k=max(k, retrieval_candidate_k))
+    return await fuse_candidates(doc_config, vector_docs, lexical_query, k)
+
+
+async def retrieve_documents(doc_config: DocConfig, vector_query: str, lexical_query: str, k: int = rerank_candidate_k) -> List[Document]:
+    """取前k个候选并重排，返回按相关度排列的全部候选，不做截断，由生成时按模型的token预算放入提示词"""
+
+    candidates = await search_candidates(doc_config, vector_query, lexical_query, k)
+    if not rerank_enabled:
+        return candidates
+
+    with span("rerank", candidates=len(candidates)):
+        return await arerank_documents(lexical_query, candidates)
+
+
+async def retrieve_documents_batch(doc_config: DocConfig, vector_queries: Sequence[str], lexical_queries: Sequence[str], k: int = rerank_candidate_k) -> List[List[Document]]:
+    """批量检索：所有问题一次编码，向量检索一起查询，之后各问题分别融合、重排"""
+
+    with span("embed_queries", size=len(vector_queries)):
+        query_vectors = await doc_config.embedding_model.aembed_documents(list(vector_queries))
+
+    if doc_config.corpus_documents is not None:
+        with span("corpus_search", documents=len(doc_config.corpus_documents), queries=len(vector_queries)):
+            candidates = await asyncio.gather(*(
+                corpus_search(doc_config.corpus_documents, doc_config.embedding_model, vector_query, lexical_query if hybrid_search_enabled else None, k, query_vector)
+                for vector_query, lexical_query, query_vector in zip(vector_queries, lexical_queries, query_vectors)
+            ))
+    else:
+        hybrid = hybrid_search_enabled and doc_config.lexical_index is not None
+        with span("vector_search", queries=len(vector_queries)):
+            vector_results = await asyncio.to_thread(search_by_vectors, doc_config.vector_store, query_vectors, max(k, retrieval_candidate_k) if hybrid else k)
+        if hybrid:
+            candidates = await asyncio.gather(*(fuse_candidates(doc_config, vector_docs, lexical_query, k) for vector_docs, lexical_query in zip(vector_results, lexical_queries)))
+        else:
+            candidates = vector_results
+
+    if not rerank_enabled:
+        return list(candidates)
+
+    with span("rerank", candidates=sum(len(docs) for docs in candidates)):
+        return list(await asyncio.gather(*(arerank_documents(lexical_query, docs) for lexical_query, docs in zip(lexical_queries, candidates))))
@@ -1,17 +1,39 @@
 import os
+import json
+import time
+import uuid
+import random
 import shutil
-from typing import Optional
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Collection, Dict, Iterable, Iterator, List, Optional
 
 from langchain_openai import OpenAIEmbeddings
 from langchain_ollama import OllamaEmbeddings
+import chromadb
+from chromadb.api.shared_system_client import SharedSystemClient
 from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from pydantic import SecretStr
 
-from schemas.DocQA_types import InvokeResponse
-from config import vector_cache_path
-from extension import current_doc_config
+from rag.clients import client_pool
+from rag.embedding_cache import CachedEmbeddings
+from rag.lexical import LexicalIndex, LexicalIndexBuilder
+from rag.metrics import span, timed_iter, record_stage
+from rag.numpy_store import NumpyVectorStore, numpy_store_dtypes
+from rag.pdf_parallel import count_pdf_pages, iter_pdf_pages_serial, iter_pdf_pages_parallel
+from schemas.DocQA_types import InvokeResponse, IngestJob
+from config import (
+    vector_cache_path, embedding_cache_path, chunk_size, chunk_overlap,
+    embedding_batch_size, embedding_max_workers, embedding_max_retries, embedding_retry_base_delay,
+    pdf_parse_workers, pdf_parse_pages_per_task, pdf_parse_parallel_min_pages, vector_store_backend as default_vector_store_backend,
+    max_open_vector_stores
+)
 
 
 def build_embedding_model(embedding_model: str, api_key: Optional[SecretStr] = None):
@@ -25,14 +47,14 @@ def build_embedding_model(embedding_model: str, api_key: Optional[SecretStr] = N
         if embedding_model == "llama3":
             result.addition_args = {
                 "embedding_model_name": embedding_model,
-                "embedding_model": OllamaEmbeddings(model="llama3")
+                "embedding_model": client_pool.get_or_create("embedding", embedding_model, None, lambda: OllamaEmbeddings(model="llama3"))
             }
             return result
         elif embedding_model == "OpenAIEmbeddings":
             if api_key is not None:
                 result.addition_args = {
                     "embedding_model_name": embedding_model,
-                    "embedding_model": OpenAIEmbeddings(api_key=api_key)
+                    "embedding_model": client_pool.get_or_create("embedding", embedding_model, api_key, lambda: OpenAIEmbeddings(api_key=api_key))
                 }
             else:
                 result.state = False
@@ -48,68 +70,562 @@ def build_embedding_model(embedding_model: str, api_key: Optional[SecretStr] = N
         return result
 
 
-def load_and_index_pdf(file_path: str):
+# 向量库清单文件，记录构建向量库时的参数，参数一致时直接复用已持久化的向量库
+manifest_file_name = "manifest.json"
+# 之前版本所有文档的collection都叫这个名字，现在每个文档按内容hash命名，旧清单中记录的名字仍然可用
+collection_name = "example_collection"
+
+# 可选的向量库后端：chroma，或者进程内的numpy矩阵，numpy可选用float16、int8存储以减少内存
+vector_store_backends = ("chroma",) + tuple(f"numpy_{dtype}" for dtype in numpy_store_dtypes)
+
+
+def compute_file_hash(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def document_collection_name(file_hash: str) -> str:
+    return f"doc_{file_hash[:16]}"
+
+
+def index_directory(file_hash: str, embedding_model_name: Optional[str], vector_store_backend: str = default_vector_store_backend) -> str:
+    """向量库目录由文件内容hash和构建参数决定，同名的不同文档、同一文档的不同构建参数互不覆盖，文件名只记录在清单中"""
+
+    params = f"{embedding_model_name}\x00{chunk_size}\x00{chunk_overlap}\x00{vector_store_backend}"
+    return os.path.join(vector_cache_path, f"{file_hash[:16]}-{hashlib.sha256(params.encode('utf-8')).hexdigest()[:8]}")
+
+
+def build_manifest(file_hash: str, embedding_model_name: Optional[str], chunk_count: int, vector_store_backend: str = default_vector_store_backend, file_name: Optional[str] = None, collection_name_: Optional[str] = None):
+    return {
+        "file_hash": file_hash,
+        "file_name": file_name,
+        "embedding_model_name": embedding_model_name,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "collection_name": collection_name_ or document_collection_name(file_hash),
+        "vector_store_backend": vector_store_backend,
+        "chunk_count": chunk_count
+    }
+
+
+def read_manifest(vector_cache_path_: str):
+    manifest_path = os.path.join(vector_cache_path_, manifest_file_name)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(vector_cache_path_: str, manifest: dict):
+    # 先写临时文件再替换，避免中途失败留下不完整的清单
+    manifest_path = os.path.join(vector_cache_path_, manifest_file_name)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def manifest_matches(manifest: Optional[dict], file_hash: str, embedding_model_name: Optional[str], vector_store_backend: str = default_vector_store_backend) -> bool:
+    return manifest is not None and manifest.get("file_hash") == file_hash and manifest_compatible(manifest, embedding_model_name, vector_store_backend)
+
+
+def find_previous_version(file_name: str, file_hash: str, embedding_model_name: Optional[str], vector_store_backend: str = default_vector_store_backend) -> Optional[str]:
+    """找到同名文档当前版本（最近构建、未被取代）的、参数一致的向量库目录"""
+
+    if not os.path.exists(vector_cache_path):
+        return None
+
+    previous_path, previous_mtime = None, 0.0
+    for name in os.listdir(vector_cache_path):
+        vector_cache_path_ = os.path.join(vector_cache_path, name)
+        manifest = read_manifest(vector_cache_path_)
+        if manifest is None or manifest.get("file_name") != file_name or manifest.get("file_hash") == file_hash or manifest.get("superseded_by"):
+            continue
+        if not manifest_compatible(manifest, embedding_model_name, vector_store_backend):
+            continue
+        mtime = os.path.getmtime(os.path.join(vector_cache_path_, manifest_file_name))
+        if mtime > previous_mtime:
+            previous_path, previous_mtime = vector_cache_path_, mtime
+    return previous_path
+
+
+def manifest_compatible(manifest: Optional[dict], embedding_model_name: Optional[str], vector_store_backend: str = default_vector_store_backend) -> bool:
+    # 编码模型、分割参数、后端都一致时，文档改动后可以在原向量库上增量更新
+    if manifest is None:
+        return False
+    expected = build_manifest("", embedding_model_name, 0, vector_store_backend)
+    # 之前版本的清单没有记录后端，都是chroma
+    manifest = {"vector_store_backend": "chroma", **manifest}
+    return all(manifest.get(key) == expected[key] for key in ("embedding_model_name", "chunk_size", "chunk_overlap", "vector_store_backend"))
+
+
+# 已打开的向量库和倒排索引，多个会话打开同一文档时共用同一个对象；
+# 跨文档检索会打开很多文档，只保留最近使用的max_open_vector_stores个
+opened_vector_stores: "OrderedDict[str, VectorStore]" = OrderedDict()
+opened_lexical_indexes: Dict[str, LexicalIndex] = {}
+opened_vector_stores_lock = threading.Lock()
+
+
+def remember_opened_vector_store(vector_cache_path_: str, vector_store: VectorStore):
+    # 调用方需持有opened_vector_stores_lock
+    opened_vector_stores[vector_cache_path_] = vector_store
+    opened_vector_stores.move_to_end(vector_cache_path_)
+    while len(opened_vector_stores) > max_open_vector_stores:
+        evicted_path, _ = opened_vector_stores.popitem(last=False)
+        opened_lexical_indexes.pop(evicted_path, None)
+
+
+def create_vector_store(vector_cache_path_: str, vector_store_backend: str, embeddings: Embeddings, collection_name_: str = collection_name) -> VectorStore:
+    if vector_store_backend == "chroma":
+        # 按余弦距离建索引，检索名次和分数与numpy后端一致，跨文档检索时可以放在一起比较
+        return Chroma(
+            collection_name=collection_name_,
+            embedding_function=embeddings,
+            persist_directory=vector_cache_path_,  # Where to save data locally, remove if not necessary
+            collection_metadata={"hnsw:space": "cosine"}
+        )
+    return NumpyVectorStore(embeddings, vector_cache_path_, dtype=vector_store_backend.removeprefix("numpy_"))
+
+
+def load_vector_store(vector_cache_path_: str, collection_name_: str, embeddings: Embeddings, vector_store_backend: str = "chroma") -> VectorStore:
+    if vector_store_backend == "chroma":
+        return Chroma(
+            collection_name=collection_name_,
+            embedding_function=embeddings,
+            persist_directory=vector_cache_path_,
+        )
+    return NumpyVectorStore.load(vector_cache_path_, embeddings)
+
+
+def open_vector_store(vector_cache_path_: str, collection_name_: str, embeddings: Embeddings, vector_store_backend: str = "chroma") -> VectorStore:
+    with opened_vector_stores_lock:
+        vector_store = opened_vector_stores.get(vector_cache_path_)
+        if vector_store is None:
+            vector_store = load_vector_store(vector_cache_path_, collection_name_, embeddings, vector_store_backend)
+        remember_opened_vector_store(vector_cache_path_, vector_store)
+        return vector_store
+
+
+def open_lexical_index(vector_cache_path_: str, vector_store: VectorStore) -> LexicalIndex:
+    with opened_vector_stores_lock:
+        lexical_index = opened_lexical_indexes.get(vector_cache_path_)
+    if lexical_index is not None:
+        return lexical_index
+
+    lexical_index = LexicalIndex.load(vector_cache_path_)
+    if lexical_index is None:
+        # 之前版本构建的向量库没有倒排索引，用库中已有的片段补建，不需要重新编码
+        lexical_index = build_lexical_index(vector_store)
+        lexical_index.save(vector_cache_path_)
+
+    with opened_vector_stores_lock:
+        return opened_lexical_indexes.setdefault(vector_cache_path_, lexical_index)
+
+
+def build_lexical_index(vector_store: VectorStore) -> LexicalIndex:
+    builder = LexicalIndexBuilder()
+    stored = vector_store.get(include=["documents"])  # type: ignore[attr-defined]
+    builder.add_documents(Document(page_content=text, id=doc_id) for doc_id, text in zip(stored["ids"], stored["documents"]))
+    return builder.build()
+
+
+def close_vector_store(vector_cache_path_: str):
+    with opened_vector_stores_lock:
+        opened_vector_stores.pop(vector_cache_path_, None)
+        opened_lexical_indexes.pop(vector_cache_path_, None)
+
+
+def load_existing_index(file_path: str, file_hash: str, embedding_model: Optional[Embeddings], embedding_model_name: Optional[str], vector_store_backend: str = default_vector_store_backend):
     # 返回信息
     result = InvokeResponse(
-        source=load_and_index_pdf.__name__,
+        source=load_existing_index.__name__,
         state=True,
-        message="构建数据库成功"
+        message="已加载已有向量库！"
     )
 
-    # 文件名
-    file_name = os.path.basename(file_path).split(".")[0]
+    if embedding_model is None:
+        result.state = False
+        result.message = f"请先配置embedding model!"
+        return result
+
+    vector_cache_path_ = index_directory(file_hash, embedding_model_name, vector_store_backend)
+
+    manifest = read_manifest(vector_cache_path_)
+    if not manifest_matches(manifest, file_hash, embedding_model_name, vector_store_backend):
+        result.state = False
+        result.message = "没有可复用的向量库。"
+        return result
 
-    # 加载PDF
     try:
-        loader = loader = PyPDFLoader(file_path)
-        docs = loader.load()
+        vector_store = open_vector_store(vector_cache_path_, manifest["collection_name"], embedding_model, vector_store_backend)  # type: ignore[index]
+        lexical_index = open_lexical_index(vector_cache_path_, vector_store)
     except Exception as e:
         result.state = False
-        result.message = f"加载PDF失败！\n{e}"
+        result.message = f"加载已有向量库失败！\n{e}"
         return result
 
-    # 分割文本
+    result.addition_args = {
+        "vector_store": vector_store,
+        "lexical_index": lexical_index,
+        "vector_store_cache_path": vector_cache_path_,
+        "file_hash": file_hash,
+        "reused": True,
+        "cache_hits": 0,
+        "cache_misses": 0
+    }
+
+    return result
+
+
+class IngestCancelled(Exception):
+    pass
+
+
+def check_cancelled(job: Optional[IngestJob]):
+    if job is not None and job.cancel_requested:
+        raise IngestCancelled()
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    if getattr(e, "status_code", None) == 429:
+        return True
+    if getattr(getattr(e, "response", None), "status_code", None) == 429:
+        return True
+    message = str(e).lower()
+    return "429" in message or "rate limit" in message
+
+
+class RateLimitGate:
+    """所有编码线程共用的限流闸门，任一批次被限流后其余批次也一起暂停"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def pause(self, delay: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+
+def embed_with_retry(embeddings: Embeddings, texts: List[str], gate: RateLimitGate) -> List[List[float]]:
+    attempt = 0
+    while True:
+        gate.wait()
+        try:
+            with span("embed_batch", size=len(texts)):
+                return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt >= embedding_max_retries or not is_rate_limit_error(e):
+                raise
+            # 指数退避加随机抖动，避免所有批次同时重试
+            gate.pause(embedding_retry_base_delay * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+
+def upsert_embeddings(vector_store: VectorStore, documents: List[Document], vectors: List[List[float]]):
+    # NumpyVectorStore.upsert与Chroma collection的参数一致
+    collection = vector_store if isinstance(vector_store, NumpyVectorStore) else vector_store._collection  # type: ignore[attr-defined]
+    collection.upsert(
+        ids=[doc.id or str(uuid.uuid4()) for doc in documents],
+        embeddings=vectors,  # type: ignore[arg-type]
+        metadatas=[doc.metadata for doc in documents],
+        documents=[doc.page_content for doc in documents]
+    )
+
+
+def copy_embeddings(source: VectorStore, target: VectorStore, documents: List[Document]) -> int:
+    """从旧版本向量库读出未改动片段的向量写入新向量库，不需要重新编码"""
+
+    collection = source if isinstance(source, NumpyVectorStore) else source._collection  # type: ignore[attr-defined]
+    stored = collection.get(ids=[doc.id for doc in documents], include=["embeddings"])
+    vectors = dict(zip(stored["ids"], stored["embeddings"]))
+    upsert_embeddings(target, documents, [vectors[doc.id] for doc in documents])
+    return len(documents)
+
+
+def iter_pdf_pages(file_path: str, job: Optional[IngestJob] = None) -> Iterator[Document]:
+    """逐页加载PDF，不把整个文档读进内存，页数较多时用多进程解析"""
+
+    if pdf_parse_workers > 1:
+        total_pages = count_pdf_pages(file_path)
+        if total_pages >= pdf_parse_parallel_min_pages:
+            yield from iter_pdf_pages_parallel(file_path, total_pages, pdf_parse_workers, pdf_parse_pages_per_task, job)
+            return
+
+    for page in iter_pdf_pages_serial(file_path, pdf_parse_pages_per_task):
+        if job is not None:
+            job.pages_parsed += 1
+        yield page
+
+
+def iter_chunks(pages: Iterable[Document], text_splitter: RecursiveCharacterTextSplitter, job: Optional[IngestJob] = None) -> Iterator[Document]:
+    # split_documents本身就是逐个文档分割的，逐页分割结果与整体分割一致
+    split_seconds = 0.0
+    chunk_count = 0
     try:
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        all_splits = text_splitter.split_documents(docs)
-    except Exception as e:
+        for page in pages:
+            start = time.perf_counter()
+            splits = text_splitter.split_documents([page])
+            split_seconds += time.perf_counter() - start
+            chunk_count += len(splits)
+            if job is not None:
+                job.chunks_split += len(splits)
+            yield from splits
+    finally:
+        record_stage("split", split_seconds, chunk_count)
+
+
+def delete_index_directory(vector_cache_path_: str):
+    """删除整个向量库目录，同时关闭chroma按路径缓存的数据库连接，之后同一路径可以重新建库"""
+
+    close_vector_store(vector_cache_path_)
+    system = SharedSystemClient._identifier_to_system.pop(vector_cache_path_, None)
+    if system is not None:
+        system.stop()
+    shutil.rmtree(vector_cache_path_, ignore_errors=True)
+
+
+def remove_superseded_indexes(paths_in_use: Collection[str]) -> int:
+    """删除已被同名文档新版本取代、且没有会话在用的向量库目录，返回删除的目录数"""
+
+    if not os.path.exists(vector_cache_path):
+        return 0
+
+    paths_in_use = {os.path.normpath(path) for path in paths_in_use}
+    removed = 0
+    for name in os.listdir(vector_cache_path):
+        vector_cache_path_ = os.path.join(vector_cache_path, name)
+        manifest = read_manifest(vector_cache_path_)
+        if manifest is None or not manifest.get("superseded_by") or os.path.normpath(vector_cache_path_) in paths_in_use:
+            continue
+        delete_index_directory(vector_cache_path_)
+        removed += 1
+    return removed
+
+
+def reset_vector_cache_dir(vector_cache_path_: str):
+    """清空向量库目录
+
+    chroma在进程内按路径缓存数据库连接，直接删掉数据库文件后再在同一路径建库会写入失败，
+    所以已有的chroma数据库通过chroma删除其中的collection，其余文件直接删除。
+    """
+
+    if not os.path.exists(vector_cache_path_):
+        os.mkdir(vector_cache_path_)
+        return
+
+    chroma_file_name = "chroma.sqlite3"
+    if os.path.exists(os.path.join(vector_cache_path_, chroma_file_name)):
+        client = chromadb.PersistentClient(path=vector_cache_path_)
+        for collection in client.list_collections():
+            client.delete_collection(collection.name)
+
+    for name in os.listdir(vector_cache_path_):
+        if name == chroma_file_name:
+            continue
+        path = os.path.join(vector_cache_path_, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def chunk_id(doc: Document, occurrence: int) -> str:
+    # 由页码和内容决定的片段id，文档修改后没变的片段id不变；同一页内容完全相同的片段按出现次序区分
+    key = f"{doc.metadata.get('page')}\x00{occurrence}\x00{doc.page_content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def iter_batches(chunks: Iterable[Document], batch_size: int) -> Iterator[List[Document]]:
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def add_documents_in_batches(vector_store: VectorStore, embeddings: Embeddings, batches: Iterable[List[Document]], job: Optional[IngestJob] = None) -> int:
+    """分批并发编码，每完成一批就写入向量库，返回写入的片段数"""
+
+    gate = RateLimitGate()
+    embedded_count = 0
+    pending: Dict[Future, List[Document]] = {}
+
+    # 编码是并发的，写入向量库只在当前线程进行
+    def upsert_finished(futures):
+        nonlocal embedded_count
+        for future in futures:
+            batch = pending.pop(future)
+            upsert_embeddings(vector_store, batch, future.result())
+            embedded_count += len(batch)
+        if job is not None:
+            job.chunks_embedded = embedded_count
+
+    executor = ThreadPoolExecutor(max_workers=embedding_max_workers)
+    try:
+        for batch in batches:
+            check_cancelled(job)
+            # 在途批次数有上限，前面的批次写入后才继续读取后面的页，内存占用不随文档长度增长
+            while len(pending) >= embedding_max_workers * 2:
+                upsert_finished(wait(pending, return_when=FIRST_COMPLETED).done)
+                check_cancelled(job)
+            future = executor.submit(embed_with_retry, embeddings, [doc.page_content for doc in batch], gate)
+            pending[future] = batch
+
+        while pending:
+            upsert_finished(wait(pending, return_when=FIRST_COMPLETED).done)
+            check_cancelled(job)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return embedded_count
+
+
+def load_and_index_pdf(file_path: str, embedding_model: Optional[Embeddings], embedding_model_name: Optional[str], file_hash: Optional[str] = None, job: Optional[IngestJob] = None, vector_store_backend: str = default_vector_store_backend):
+    # 返回信息
+    result = InvokeResponse(
+        source=load_and_index_pdf.__name__,
+        state=True,
+        message="构建数据库成功"
+    )
+
+    if not os.path.exists(file_path):
         result.state = False
-        result.message = f"分割文本失败！\n{e}"
+        result.message = f"加载PDF失败！\n{file_path}不存在"
         return result
+    if file_hash is None:
+        file_hash = compute_file_hash(file_path)
 
-    # 编码用模型
-    if current_doc_config.embedding_model is not None:
-        embeddings = current_doc_config.embedding_model
+    # 编码用模型，套一层缓存，相同模型、相同分割参数下已编码过的文本不再重复编码
+    if embedding_model is not None:
+        embeddings = CachedEmbeddings(
+            embedding_model,
+            namespace=f"{embedding_model_name}:{chunk_size}:{chunk_overlap}",
+            cache_db_path=os.path.join(embedding_cache_path, "embeddings.sqlite")
+        )
     else:
         result.state = False
         result.message = f"请先配置embedding model!"
         return result
 
+    if job is not None and job.cancel_requested:
+        result.state = False
+        result.message = "已取消构建向量库。"
+        return result
+
     # 向量库缓存路径
-    vector_cache_path_ = os.path.join(vector_cache_path, file_name)
-    if os.path.exists(vector_cache_path_):
-        shutil.rmtree(vector_cache_path_)
-    os.mkdir(vector_cache_path_)
-
-    # 使用的向量库
-    vector_store = Chroma(
-        collection_name="example_collection",
-        embedding_function=embeddings,
-        persist_directory=vector_cache_path_,  # Where to save data locally, remove if not necessary
-    )
+    vector_cache_path_ = index_directory(file_hash, embedding_model_name, vector_store_backend)
+    close_vector_store(vector_cache_path_)
+
+    reset_vector_cache_dir(vector_cache_path_)
+    collection_name_ = document_collection_name(file_hash)
+    vector_store = create_vector_store(vector_cache_path_, vector_store_backend, embeddings, collection_name_)
+
+    # 同名文档的新版本：参数一致时只编码改动的片段，没变的片段从旧版本复制向量；
+    # 旧版本可能正被其他会话使用，只读不改，新版本总是写入自己的目录
+    previous_path = find_previous_version(os.path.basename(file_path), file_hash, embedding_model_name, vector_store_backend)
+    incremental = previous_path is not None
+    if previous_path is not None:
+        previous_manifest = read_manifest(previous_path)
+        previous_store = load_vector_store(previous_path, previous_manifest["collection_name"], embeddings, vector_store_backend)  # type: ignore[index]
+        previous_ids = set(previous_store.get(include=[])["ids"])  # type: ignore[attr-defined]
+    else:
+        previous_store = None
+        previous_ids = set()
+
+    # 加载、分割、编码以流水线方式逐页进行
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = iter_chunks(timed_iter(iter_pdf_pages(file_path, job), "pdf_parse"), text_splitter, job)
+
+    # 倒排索引与向量库同时构建，片段在两边使用相同的id；倒排索引收录所有片段，只有向量库中没有的片段才编码
+    lexical_builder = LexicalIndexBuilder()
+    new_ids = set()
+    occurrences: Counter = Counter()
+    kept_chunks: List[Document] = []
+    kept_count = 0
+
+    def changed_chunks():
+        nonlocal kept_count
+        for doc in chunks:
+            base_id = chunk_id(doc, 0)
+            doc.id = chunk_id(doc, occurrences[base_id]) if occurrences[base_id] else base_id
+            occurrences[base_id] += 1
+            new_ids.add(doc.id)
+            lexical_builder.add_documents([doc])
+            if doc.id not in previous_ids:
+                yield doc
+                continue
+            # 旧版本中已有的片段攒够一批后一起复制
+            kept_chunks.append(doc)
+            if len(kept_chunks) >= embedding_batch_size:
+                kept_count += copy_embeddings(previous_store, vector_store, kept_chunks)  # type: ignore[arg-type]
+                kept_chunks.clear()
+        if kept_chunks:
+            kept_count += copy_embeddings(previous_store, vector_store, kept_chunks)  # type: ignore[arg-type]
+            kept_chunks.clear()
 
     # 构建向量库
     try:
-        _ = vector_store.add_documents(documents=all_splits)
+        with span("index_build", backend=vector_store_backend, incremental=incremental):
+            embedded_count = add_documents_in_batches(vector_store, embeddings, iter_batches(changed_chunks(), embedding_batch_size), job)
+        # 旧版本中有、新版本中已经没有的片段不会被复制
+        deleted_count = len(previous_ids - new_ids)
+        if isinstance(vector_store, NumpyVectorStore):
+            vector_store.persist()
+        lexical_index = lexical_builder.build()
+        lexical_index.save(vector_cache_path_)
+    except IngestCancelled:
+        # 没写清单的向量库不完整，直接删掉
+        reset_vector_cache_dir(vector_cache_path_)
+        result.state = False
+        result.message = "已取消构建向量库。"
+        return result
     except Exception as e:
         result.state = False
         result.message = f"构建向量库失败\n{e}"
         return result
-    
+
+    # 向量库构建完成后再写清单，清单存在即代表向量库完整可用
+    write_manifest(vector_cache_path_, build_manifest(file_hash, embedding_model_name, len(new_ids), vector_store_backend, os.path.basename(file_path), collection_name_))
+    with opened_vector_stores_lock:
+        remember_opened_vector_store(vector_cache_path_, vector_store)
+        opened_lexical_indexes[vector_cache_path_] = lexical_index
+
+    # 旧版本标记为已被取代，不再出现在文档库中，没有会话在用时由remove_superseded_indexes删除
+    if previous_path is not None:
+        write_manifest(previous_path, {**previous_manifest, "superseded_by": file_hash})  # type: ignore[dict-item]
+
+    if incremental:
+        result.message = f"增量更新向量库成功，新增{embedded_count}个片段，删除{deleted_count}个片段"
+
     result.addition_args = {
         "vector_store": vector_store,
-        "vector_store_cache_path": vector_cache_path_
+        "lexical_index": lexical_index,
+        "vector_store_cache_path": vector_cache_path_,
+        "file_hash": file_hash,
+        "reused": False,
+        "incremental": incremental,
+        "chunks_added": embedded_count,
+        "chunks_deleted": deleted_count,
+        "chunks_kept": kept_count,
+        "cache_hits": embeddings.hits,
+        "cache_misses": embeddings.misses
     }
 
     return result
-
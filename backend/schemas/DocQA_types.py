@@ -1,10 +1,16 @@
-from pydantic import BaseModel, SecretStr
+import asyncio
+
+from pydantic import BaseModel, Field, SecretStr
 from typing import List, Dict, Optional, Any
 
+from config import vector_store_backend as default_vector_store_backend
+
 
 class DocConfig(BaseModel):
+    session_id: Optional[str] = None
     file_name: Optional[str] = None
     tmp_file_path: Optional[str] = None
+    file_hash: Optional[str] = None
     lanuage: Optional[str] = None
     embedding_model_name: Optional[str] = None
     embedding_model: Any = None
@@ -13,9 +19,17 @@ class DocConfig(BaseModel):
     llm_api_key: Optional[SecretStr] = None
     llm_model: Any = None
     graph: Optional[Dict[str, Any]] = None
+    vector_store_backend: str = default_vector_store_backend
     vector_store: Any = None
+    lexical_index: Any = None
+    # 跨文档问答时选中的文档，每项包含doc_id和file_name，为None时只在当前文档中检索
+    corpus_documents: Optional[List[Dict[str, Any]]] = None
     vector_cache_path: Optional[str] = None
+    thread_id: Optional[str] = None
     chat_history: Optional[List] = []
+    chat_summary: str = ""
+    # 同一会话的问答逐轮进行，并发的两轮都从同一份对话记录出发时，后保存的一轮会覆盖前一轮
+    turn_lock: Any = Field(default_factory=asyncio.Lock)
     
 
 class InvokeResponse(BaseModel):
@@ -23,3 +37,19 @@ class InvokeResponse(BaseModel):
     state: bool
     message: str = ""
     addition_args: Optional[Dict[str, Any]] = None
+
+
+class IngestJob(BaseModel):
+    job_id: str
+    session_id: Optional[str] = None
+    file_path: str
+    # 上传时已计算的文件hash，为None时入库前重新计算
+    file_hash: Optional[str] = None
+    status: str = "pending"  # pending, running, succeeded, failed, cancelled
+    message: str = ""
+    pages_parsed: int = 0
+    chunks_split: int = 0
+    chunks_embedded: int = 0
+    cancel_requested: bool = False
+    finished_at: Optional[float] = None
+    addition_args: Optional[Dict[str, Any]] = None
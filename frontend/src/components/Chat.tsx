@@ -2,9 +2,9 @@ import { useEffect, useRef, useState } from "react";
 import ReactMarkdown from "react-markdown";
 
 import { SettingPopover } from "./Settings";
-import { DocConfig, RequestMessage } from "@/types/common";
+import { DocConfig } from "@/types/common";
 import { ChatMessage } from "@/types/chat";
-import { SendDataToBackend } from "@/types/api";
+import { StreamDataFromBackend } from "@/types/api";
 
 
 function ChatInput(
@@ -132,17 +132,34 @@ export function Chat(
         chat_history.push(chat_message);
         currentDocConfigOnUpdate({...currentDocConfig, chat_history: chat_history});
 
-        // 向后端发送问题
-        const response: RequestMessage = await SendDataToBackend({"question": sendMessage}, "api/chat", 60000);
-        if (response.state && typeof response.addition_args.role === "string" && typeof response.addition_args.message === "string") {
+        // 向后端发送问题，回复逐字返回
+        let answer = "";
+        const stream_error = { message: "" };
+        try {
+            await StreamDataFromBackend({"question": sendMessage}, "api/chat/stream", (event, data) => {
+                if (event === "token" && typeof data.content === "string") {
+                    answer += data.content;
+                    currentDocConfigOnUpdate({...currentDocConfig, chat_history: [...chat_history, { role: "ai", message: answer }]});
+                }
+                else if (event === "done" && typeof data.message === "string") answer = data.message;
+                else if (event === "error" && typeof data.message === "string") stream_error.message = data.message;
+            });
+        }
+        catch (e) {
+            console.log("/frontend/src/component/Chat handleSend: catch error: ", e);
+            stream_error.message = "请求失败！";
+        }
+
+        if (stream_error.message.length === 0) {
             // 记录历史信息
-            chat_message = { role: response.addition_args.role, message: response.addition_args.message }
+            chat_message = { role: "ai", message: answer }
             chat_history.push(chat_message);
             currentDocConfigOnUpdate({...currentDocConfig, chat_history: chat_history});
         }
         else {
             // TODO: 在对话区域显示错误
-            alert(response.message);
+            currentDocConfigOnUpdate({...currentDocConfig, chat_history: chat_history});
+            alert(stream_error.message);
         }
 
         setIsThinking(false);
@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import type { DocConfig, RequestMessage } from '@/types/common';
-import { base_url, SendDataToBackend } from '@/types/api';
+import { base_url, SendDataToBackend, GetDataFromBackend } from '@/types/api';
 import { docs_lanuages_list } from '@/types/setting';
 
 
@@ -123,9 +123,18 @@ export function PDFViewer(
         // 调试信息
         console.log("/frontend/src/component/PDFViewer handleEmbed: 正在构建向量库...");
 
-        // 请求后端根据当前文档构建
-        const response: RequestMessage = await SendDataToBackend(new FormData(), "api/embedding", null);
-        if (response.state) currentDocConfigOnUpdate({...currentDocConfig, is_embedded: true});
+        // 请求后端根据当前文档构建，后端在后台构建并返回任务id
+        let response: RequestMessage = await SendDataToBackend(new FormData(), "api/embedding", 3000);
+        const job_id = response.addition_args?.job_id;
+
+        // 轮询构建进度直到任务结束
+        while (response.state && typeof job_id === "string" && (response.addition_args.status === "pending" || response.addition_args.status === "running")) {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            response = await GetDataFromBackend(`api/embedding/${job_id}`, 3000);
+            console.log(`/frontend/src/component/PDFViewer handleEmbed: 已解析${response.addition_args?.pages_parsed}页，已编码${response.addition_args?.chunks_embedded}/${response.addition_args?.chunks_split}段`);
+        }
+
+        if (response.state && response.addition_args.status === "succeeded") currentDocConfigOnUpdate({...currentDocConfig, is_embedded: true});
         else alert(response.message);
 
         // 调试信息
@@ -5,6 +5,27 @@ import { RequestMessage } from "@/types/common";
 
 export const base_url = "http://localhost:8000";
 
+// 会话id保存在localStorage中，刷新页面后沿用，后端据此区分不同用户的文档和对话
+const session_id_key = "docqa_session_id";
+
+function LoadSessionId(): string {
+    const new_id = (typeof crypto !== "undefined" && "randomUUID" in crypto) ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
+    // 构建静态页面时没有window，也没有localStorage
+    if (typeof window === "undefined") return new_id;
+    try {
+        const saved_id = window.localStorage.getItem(session_id_key);
+        if (saved_id) return saved_id;
+        window.localStorage.setItem(session_id_key, new_id);
+    }
+    catch (e) {
+        // 浏览器禁用存储时只在当前页面内使用
+        console.log("/frontend/types/api LoadSessionId: catch error: ", e);
+    }
+    return new_id;
+}
+
+export const session_id: string = LoadSessionId();
+
 
 // 向后端发送信息 
 export async function SendDataToBackend(
@@ -16,10 +37,11 @@ export async function SendDataToBackend(
     if (time_out) {
         request = axios.create({
             baseURL: base_url,
-            timeout: time_out
+            timeout: time_out,
+            headers: { "X-Session-Id": session_id }
         });
     }
-    else request = axios.create({ baseURL: base_url });
+    else request = axios.create({ baseURL: base_url, headers: { "X-Session-Id": session_id } });
 
     let response = null;
 
@@ -35,3 +57,64 @@ export async function SendDataToBackend(
 
     return response;
 }
+
+
+// 从后端获取信息
+export async function GetDataFromBackend(url: string, time_out: number | null): Promise<RequestMessage> {
+    const request = time_out ? axios.create({ baseURL: base_url, timeout: time_out, headers: { "X-Session-Id": session_id } }) : axios.create({ baseURL: base_url, headers: { "X-Session-Id": session_id } });
+
+    let response = null;
+
+    try {
+        response = await request.get(url);
+        response = response.data;
+    }
+    catch (e) {
+        console.log("/frontend/types/api GetDataFromBackend: catch error: ", e);
+        response = { source: "", state: false, message: "请求失败！", addition_args: { "error": e } };
+    }
+
+    return response;
+}
+
+
+// 以SSE方式向后端发送信息，每收到一个事件就回调一次
+export async function StreamDataFromBackend(
+    data: Record<string, string | number | boolean | null>,
+    url: string,
+    onEvent: (event: string, data: Record<string, unknown>) => void
+): Promise<void> {
+    const response = await fetch(`${base_url}/${url}`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "X-Session-Id": session_id },
+        body: JSON.stringify(data)
+    });
+    if (!response.ok || !response.body) throw new Error(`请求失败！${response.status}`);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // 事件之间以空行分隔
+        let index = buffer.indexOf("\n\n");
+        while (index >= 0) {
+            const raw_event = buffer.slice(0, index);
+            buffer = buffer.slice(index + 2);
+
+            let event = "message";
+            let payload = "";
+            for (const line of raw_event.split("\n")) {
+                if (line.startsWith("event: ")) event = line.slice(7);
+                else if (line.startsWith("data: ")) payload += line.slice(6);
+            }
+            onEvent(event, payload ? JSON.parse(payload) : {});
+
+            index = buffer.indexOf("\n\n");
+        }
+    }
+}